@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: building the vision request body for a 2048px page
+
+Compares the previous approach (base64 -> str -> f-string data URL -> dict ->
+stdlib JSON encoder) with VisionPayloadBuilder's cached framing and chunked
+base64. Reports CPU time and peak Python allocations for each.
+
+Run from the repository root:
+    python benchmarks/payload_benchmark.py
+"""
+import base64
+import io
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from PIL import Image
+
+from src.lm_studio_client import OCR_PROMPT
+from src.payload import VisionPayloadBuilder
+
+MODEL_NAME = "nielsgl/RolmOCR-8bit"
+ROUNDS = 20
+
+
+def make_page() -> bytes:
+    """A 2048x2048 JPEG with enough detail to compress like a scanned page"""
+    noise = Image.effect_noise((2048, 2048), 64).convert('RGB')
+    buffer = io.BytesIO()
+    noise.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def legacy_body(image_data: bytes) -> int:
+    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    payload = {
+        "model": MODEL_NAME,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": OCR_PROMPT},
+                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+                ]
+            }
+        ],
+        "temperature": 0.1,
+        "max_tokens": 2000
+    }
+    # aiohttp's json= serializes with json.dumps and encodes to bytes
+    return len(json.dumps(payload).encode('utf-8'))
+
+
+def streamed_body(builder: VisionPayloadBuilder, image_data: bytes) -> int:
+    # Consume the chunks the way the HTTP writer does, one at a time
+    _, chunks = builder.build(image_data, max_tokens=2000)
+    return sum(len(chunk) for chunk in chunks)
+
+
+def measure(label, func):
+    func()  # warm caches
+    started = time.process_time()
+    for _ in range(ROUNDS):
+        func()
+    cpu_ms = (time.process_time() - started) / ROUNDS * 1000
+    
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(f"{label:<10} {cpu_ms:8.2f} ms/page   peak {peak / 1024 / 1024:8.2f} MiB")
+
+
+def main():
+    image_data = make_page()
+    builder = VisionPayloadBuilder(MODEL_NAME, OCR_PROMPT)
+    assert legacy_body(image_data) == streamed_body(builder, image_data)
+    
+    print(f"Page: 2048x2048 JPEG, {len(image_data) / 1024 / 1024:.2f} MiB encoded")
+    measure("legacy", lambda: legacy_body(image_data))
+    measure("streamed", lambda: streamed_body(builder, image_data))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for production multi-worker deployments
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the master (preload), so configuration errors
+surface before any worker is forked and workers share the FastAPI app and its
+configuration. PIL, PyMuPDF and aiohttp are not part of that: they are
+imported lazily in each worker (on first use, or during warm-up). Connection
+pools and the shared cache are created per worker in the FastAPI startup
+hook, after the fork.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WORKERS", str(multiprocessing.cpu_count())))
+# The app sizes each worker's share of the model slots from WORKERS
+os.environ["WORKERS"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+reload = False
+
+# OCR of a long PDF can legitimately take minutes
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Offline bulk OCR: process a directory tree or a manifest of files without the HTTP layer
+
+Files are decoded in a process pool (FileProcessor) and their pages are sent
+to LM Studio from this process (OCRService). Every finished file is appended
+to a JSONL output, which doubles as the checkpoint: re-running the same
+command skips files that already succeeded or can never succeed (unsupported
+content, size, frame or page limits, marked "permanent") and retries the
+others, including files with pages that failed or fell back to raw text.
+
+Usage:
+    python ingest.py /data/scans --output results.jsonl
+    python ingest.py manifest.txt --output results.jsonl --workers 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set
+
+from dotenv import load_dotenv
+
+from src.config import Config
+from src.file_processor import FileProcessor
+from src.lm_studio_client import LMStudioClient
+from src.ocr_service import OCRService
+from src.scheduler import BATCH
+
+# Per-process FileProcessor, created by the pool initializer
+_file_processor: Optional[FileProcessor] = None
+
+
+def _init_worker() -> None:
+    """Process pool initializer: load configuration once per worker process"""
+    global _file_processor
+    load_dotenv()
+    _file_processor = FileProcessor(Config())
+
+
+def prepare_file(path: str) -> Dict[str, Any]:
+    """Read, validate and decode one file into OCR-ready pages (runs in the pool)
+
+    Errors are returned as ``{"error", "permanent"}``; permanent errors are
+    properties of the file (4xx validation errors) that a retry cannot fix.
+    """
+    from fastapi import HTTPException
+
+    config = _file_processor.config
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        if len(content) > config.MAX_FILE_SIZE_BYTES:
+            return {"error": f"File too large. Maximum size: {config.MAX_FILE_SIZE_MB}MB", "permanent": True}
+
+        detected_format = _file_processor.detect_format(content)
+        file_type = config.get_format_file_type(detected_format)
+        if file_type == "image":
+            info = asyncio.run(_file_processor.process_image(content, detected_format))
+            pages = list(info.pop("frames"))
+        else:
+            info = asyncio.run(_file_processor.process_pdf(content))
+            pages = list(info.pop("pages"))
+    except HTTPException as e:
+        # HTTPException does not survive pickling back to the parent process
+        return {"error": e.detail, "permanent": e.status_code < 500}
+    except Exception as e:
+        return {"error": str(e), "permanent": False}
+
+    return {"file_type": file_type, "info": info, "pages": pages}
+
+
+def discover_files(source: Path) -> Iterator[str]:
+    """Yield absolute paths from a directory tree or a manifest file
+    
+    Every regular file of a directory tree is yielded, whatever its
+    extension: content decides whether it can be processed, and files that
+    cannot are recorded as permanent failures.
+    """
+    if source.is_dir():
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    yield os.path.abspath(path)
+        return
+
+    # Manifest: one path per line (relative to the current directory);
+    # blank lines and lines starting with '#' are ignored
+    with open(source, "r") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield os.path.abspath(line)
+
+
+def is_done(record: Dict[str, Any]) -> bool:
+    """Whether a result record needs no retry on resume"""
+    if not record.get("success"):
+        return bool(record.get("permanent"))
+    # Pages that failed or fell back to raw text were transient model failures
+    return not any(page.get("error") or page.get("fallback") for page in record.get("pages", []))
+
+
+def load_checkpoint(output: Path) -> Set[str]:
+    """Return the paths that already have a final result in the output"""
+    done = set()
+    if not output.exists():
+        return done
+
+    with open(output, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if is_done(record):
+                done.add(record["path"])
+    return done
+
+
+class Progress:
+    """Counts files and pages and reports throughput"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files = 0
+        self.failed = 0
+        self.pages = 0
+        self.skipped = 0
+
+    def line(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (f"{self.files} files ({self.failed} failed, {self.skipped} skipped), "
+                f"{self.pages} pages in {elapsed:.1f}s - "
+                f"{self.files / elapsed:.2f} files/sec, {self.pages / elapsed:.2f} pages/sec")
+
+
+async def ingest(args: argparse.Namespace) -> Progress:
+    """Run the bulk OCR job"""
+    config = Config()
+    lm_studio_client = LMStudioClient(config)
+    ocr_service = OCRService(lm_studio_client, FileProcessor(config))
+
+    output = Path(args.output)
+    done = load_checkpoint(output)
+    progress = Progress()
+    loop = asyncio.get_running_loop()
+
+    # Files being decoded plus files waiting on the model; bounds memory use
+    in_flight = asyncio.Semaphore(args.workers + args.concurrency)
+    ocr_slots = asyncio.Semaphore(args.concurrency)
+
+    await lm_studio_client.startup()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool, \
+                open(output, "a") as out:
+
+            async def handle(path: str) -> None:
+                started = time.perf_counter()
+                record: Dict[str, Any] = {"path": path}
+                try:
+                    prepared = await loop.run_in_executor(pool, prepare_file, path)
+                    if "error" in prepared:
+                        record["permanent"] = prepared["permanent"]
+                        raise Exception(prepared["error"])
+
+                    async with ocr_slots:
+                        result = await ocr_service.process_pages(
+                            prepared["file_type"], prepared["info"], iter(prepared["pages"]),
+                            os.path.basename(path), client_id="ingest", priority=BATCH
+                        )
+                    record.update(success=True, **result)
+                    progress.pages += len(result["pages"])
+                except Exception as e:
+                    record.update(success=False, error=str(e))
+                    progress.failed += 1
+                finally:
+                    in_flight.release()
+
+                record["processing_time"] = round(time.perf_counter() - started, 2)
+                progress.files += 1
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+            async def report() -> None:
+                while True:
+                    await asyncio.sleep(args.progress_interval)
+                    print(progress.line(), flush=True)
+
+            reporter = asyncio.create_task(report())
+            tasks = set()
+            try:
+                for path in discover_files(Path(args.source)):
+                    # The output may live inside the tree being ingested
+                    if path in done or path == os.path.abspath(args.output):
+                        progress.skipped += 1
+                        continue
+                    await in_flight.acquire()
+                    task = asyncio.create_task(handle(path))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            finally:
+                reporter.cancel()
+    finally:
+        await lm_studio_client.shutdown()
+
+    return progress
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Bulk OCR of a directory or manifest into JSONL")
+    parser.add_argument("source", help="Directory to walk, or a manifest file with one path per line")
+    parser.add_argument("--output", "-o", default="ocr_results.jsonl",
+                        help="JSONL output; also the checkpoint for resuming (default: ocr_results.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Preprocessing processes (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Files OCR'd at the same time (default: LM_STUDIO_MAX_CONCURRENCY)")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="Seconds between progress reports (default: 10)")
+    return parser.parse_args()
+
+
+def main():
+    """Main entry point"""
+    load_dotenv()
+    args = parse_args()
+    if args.concurrency is None:
+        args.concurrency = Config().LM_STUDIO_MAX_CONCURRENCY
+
+    if not Path(args.source).exists():
+        print(f"❌ {args.source} not found")
+        sys.exit(1)
+
+    print(f"🚀 Ingesting {args.source} -> {args.output}")
+    print(f"Workers: {args.workers}, concurrent files: {args.concurrency}")
+
+    try:
+        progress = asyncio.run(ingest(args))
+    except KeyboardInterrupt:
+        print("\n👋 Interrupted - re-run the same command to resume")
+        sys.exit(130)
+
+    print(f"✅ Done: {progress.line()}")
+    if progress.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
+import asyncio
+import os
 import time
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from typing import Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Request
 from fastapi.responses import JSONResponse
-import uvicorn
 from dotenv import load_dotenv
 
 from src.config import Config
 from src.lm_studio_client import LMStudioClient
 from src.file_processor import FileProcessor
-from src.ocr_service import OCRService
+from src.memory_budget import MemoryBudget
+from src.ocr_service import OCRService, simple_error_message
+from src.scheduler import OCRScheduler, INTERACTIVE, BATCH
+from src.shared_state import SharedCache
 
 # Load environment variables
 load_dotenv()
@@ -23,7 +28,62 @@ app = FastAPI(
 config = Config()
 lm_studio_client = LMStudioClient(config)
 file_processor = FileProcessor(config)
-ocr_service = OCRService(lm_studio_client, file_processor)
+result_cache = SharedCache(
+    os.path.join(config.STATE_DIR, "results.sqlite3"),
+    config.RESULT_CACHE_TTL_SECONDS
+)
+scheduler = OCRScheduler(
+    config.SCHEDULER_CONCURRENCY,
+    {INTERACTIVE: config.SCHEDULER_INTERACTIVE_WEIGHT, BATCH: config.SCHEDULER_BATCH_WEIGHT}
+)
+memory_budget = MemoryBudget(config.MEMORY_BUDGET_BYTES, config.MEMORY_BUDGET_WAIT_SECONDS)
+ocr_service = OCRService(lm_studio_client, file_processor, result_cache, scheduler, memory_budget)
+
+
+# Readiness is tracked separately from liveness so that autoscalers only route
+# traffic to a worker once its pools exist and (optionally) the model is warm
+readiness = {"ready": False, "warmup": "skipped"}
+
+
+async def warm_up(initial_delay: float = 1.0, max_delay: float = 30.0):
+    """Warm up decoders and the model, then mark this worker ready
+    
+    A failed warm-up (usually LM Studio being unreachable) leaves the worker
+    not ready and is retried with exponential backoff, so traffic is not
+    routed to a worker that cannot serve it.
+    """
+    delay = initial_delay
+    while True:
+        try:
+            await ocr_service.warm_up()
+            break
+        except Exception as e:
+            print(f"Warm-up failed, retrying in {delay:.0f}s: {str(e)}")
+            readiness["warmup"] = "failed"
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+    readiness["warmup"] = "completed"
+    readiness["ready"] = True
+
+
+@app.on_event("startup")
+async def startup():
+    """Per-worker initialization of connection pools and shared state"""
+    result_cache.open()
+    await lm_studio_client.startup()
+    
+    if config.WARMUP_ON_STARTUP:
+        readiness["warmup"] = "running"
+        app.state.warmup_task = asyncio.create_task(warm_up())
+    else:
+        readiness["ready"] = True
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release per-worker resources"""
+    await lm_studio_client.shutdown()
+    result_cache.close()
 
 
 @app.get("/")
@@ -32,10 +92,55 @@ async def root():
     return {"message": "OCR API Server is running", "status": "healthy"}
 
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the worker process is up and serving requests"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: pools are created and warm-up (if enabled) has finished"""
+    if not readiness["ready"]:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "starting", "warmup": readiness["warmup"]}
+        )
+    return {"status": "ready", "warmup": readiness["warmup"]}
+
+
+
+
+@app.get("/metrics")
+async def metrics():
+    """Scheduler queue depth, wait times and memory budget use (this worker)"""
+    return {
+        "scheduler": scheduler.stats(),
+        "limiter": lm_studio_client.limiter.stats(),
+        "memory": memory_budget.stats()
+    }
+
+
+def resolve_priority(api_key: Optional[str], requested: Optional[str]) -> str:
+    """Pick the priority class for a request
+    
+    Keys listed in BATCH_API_KEYS are always batch; other callers may opt
+    into batch with the X-Priority header.
+    """
+    if api_key and api_key in config.BATCH_API_KEYS:
+        return BATCH
+    if requested and requested.strip().lower() == BATCH:
+        return BATCH
+    return INTERACTIVE
 
 
 @app.post("/ocr")
-async def process_ocr(file: UploadFile = File(...)):
+async def process_ocr(
+    request: Request,
+    file: UploadFile = File(...),
+    x_priority: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None)
+):
     """
     Process uploaded image or PDF file and extract text using OCR
     """
@@ -46,12 +151,16 @@ async def process_ocr(file: UploadFile = File(...)):
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file provided")
         
+        # Pages are scheduled fairly per client and priority class
+        client_id = x_api_key or (request.client.host if request.client else "anonymous")
+        priority = resolve_priority(x_api_key, x_priority)
+        
         # Process the file and extract text
-        result = await ocr_service.process_file(file)
+        result = await ocr_service.process_file(file, client_id, priority)
         
         processing_time = time.time() - start_time
         
-        return {
+        response = {
             "success": True,
             "filename": file.filename,
             "text": result["text"],
@@ -59,19 +168,17 @@ async def process_ocr(file: UploadFile = File(...)):
             "processing_time": round(processing_time, 2),
             "file_type": result.get("file_type", "unknown")
         }
+        if "pages" in result:
+            response["pages"] = result["pages"]
+        return response
         
     except HTTPException:
         raise
     except Exception as e:
         processing_time = time.time() - start_time
-        # Provide simple error messages
-        error_message = "Processing failed"
-        if "connect" in str(e).lower() or "connection" in str(e).lower():
-            error_message = "OCR service unavailable"
-        elif "timeout" in str(e).lower():
-            error_message = "Processing timeout"
-        elif "model" in str(e).lower():
-            error_message = "OCR model error"
+        # Provide simple error messages; the details only go to the log
+        print(f"OCR request failed: {str(e)}")
+        error_message = simple_error_message(e, "Processing failed")
         
         return JSONResponse(
             status_code=500,
@@ -87,9 +194,12 @@ async def process_ocr(file: UploadFile = File(...)):
 
 
 if __name__ == "__main__":
+    import uvicorn
+    
     uvicorn.run(
         "main:app",
         host=config.HOST,
         port=config.PORT,
-        reload=config.DEBUG
+        reload=config.RELOAD,
+        workers=None if config.RELOAD else config.WORKERS
     )
@@ -2,7 +2,9 @@
 """
 Simple script to start the OCR API server with proper setup
 """
+import argparse
 import os
+import subprocess
 import sys
 from pathlib import Path
 
@@ -39,8 +41,26 @@ def check_env_file():
         print("✅ .env file found")
     return True
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Start the OCR API server")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="Run without reload watchers, using multiple workers"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: CPU count in production, 1 otherwise)"
+    )
+    return parser.parse_args()
+
 def main():
     """Main startup function"""
+    args = parse_args()
+    
     print("🚀 OCR API Server Startup")
     print("=" * 50)
     
@@ -63,7 +83,17 @@ def main():
     print("3. ⚠️  Make sure LM Studio is running with RolmOCR model loaded")
     print("4. ⚠️  Make sure the model name in .env matches your LM Studio model")
     
+    env = os.environ.copy()
+    if args.production:
+        env["DEBUG"] = "false"
+        env["RELOAD"] = "false"
+        env["WORKERS"] = str(args.workers or os.cpu_count() or 1)
+    elif args.workers:
+        env["WORKERS"] = str(args.workers)
+    
     print("\n🎯 Starting server...")
+    if "WORKERS" in env:
+        print(f"Workers: {env['WORKERS']}")
     print("Server will be available at: http://localhost:8000")
     print("API documentation: http://localhost:8000/docs")
     print("Press Ctrl+C to stop the server")
@@ -71,7 +101,7 @@ def main():
     
     try:
         # Start the server
-        os.system("python main.py")
+        subprocess.run([sys.executable, "main.py"], env=env)
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
 
@@ -0,0 +1,53 @@
+"""Token budgets and timeouts sized to each model call's input"""
+from typing import Dict, Optional, Tuple, Union
+from src.config import Config
+
+
+class TokenBudget:
+    """Derives ``max_tokens`` and the request timeout for a model call
+
+    Image calls scale with the page area and its estimated ink density, so a
+    receipt crop reserves a small decode budget while a dense full page gets
+    a large one. Text calls scale with the input length, since cleanup
+    returns roughly what it was given. Timeouts follow from the token budget,
+    so a stuck call on a small input gives its slot back quickly.
+    """
+
+    # Conservative characters per token for cleanup output
+    CHARS_PER_TOKEN = 3
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    def _clamp_tokens(self, tokens: float) -> int:
+        return int(min(self.config.OCR_MAX_TOKENS, max(self.config.OCR_MIN_TOKENS, tokens)))
+
+    def timeout(self, max_tokens: int) -> float:
+        """Request timeout for a call that may generate up to max_tokens"""
+        seconds = (self.config.OCR_TIMEOUT_BASE_SECONDS
+                   + max_tokens / 1000 * self.config.OCR_TIMEOUT_PER_1K_TOKENS)
+        return min(self.config.OCR_MAX_TIMEOUT_SECONDS, seconds)
+
+    def for_image(self, size: Optional[Tuple[int, int]], density: Optional[float] = None,
+                  min_tokens: int = 0) -> Dict[str, Union[int, float]]:
+        """Budget for OCR of an image of the given pixel size
+
+        ``density`` is the fraction of dark pixels (0-1); when unknown the
+        page is assumed to be dense. ``min_tokens`` raises the budget, e.g. to
+        that of a truncated page this image is part of.
+        """
+        if not size:
+            max_tokens = self.config.OCR_MAX_TOKENS
+        else:
+            megapixels = size[0] * size[1] / 1_000_000
+            # ~10% dark pixels is a fully printed page at any font size;
+            # blank-ish pages still get a quarter
+            scale = 1.0 if density is None else min(1.0, 0.25 + density * 7.5)
+            max_tokens = self._clamp_tokens(megapixels * self.config.OCR_TOKENS_PER_MEGAPIXEL * scale)
+        max_tokens = max(max_tokens, min_tokens)
+        return {"max_tokens": max_tokens, "timeout": self.timeout(max_tokens)}
+
+    def for_text(self, text_length: int, min_tokens: int = 0) -> Dict[str, Union[int, float]]:
+        """Budget for cleanup of text_length characters of extracted text"""
+        max_tokens = max(self._clamp_tokens(text_length / self.CHARS_PER_TOKEN * 1.25 + 64), min_tokens)
+        return {"max_tokens": max_tokens, "timeout": self.timeout(max_tokens)}
@@ -1,5 +1,13 @@
 """Configuration management for OCR API Server"""
 import os
+import tempfile
+
+# Extensions that name the same underlying format as detected from content
+FORMAT_ALIASES = {"jpg": "jpeg", "tif": "tiff"}
+
+# Image formats FileProcessor.sniff_format() can identify from magic bytes;
+# uploads are accepted by content, so other formats can never be processed
+DETECTABLE_IMAGE_FORMATS = frozenset({"jpeg", "png", "tiff", "gif", "bmp", "webp"})
 
 
 class Config:
@@ -17,40 +25,102 @@ class Config:
         
         # Supported file formats
         image_formats_str = os.getenv("SUPPORTED_IMAGE_FORMATS", "jpg,jpeg,png,bmp,tiff,webp")
-        self.SUPPORTED_IMAGE_FORMATS = [fmt.strip().lower() for fmt in image_formats_str.split(",")]
+        image_formats = frozenset(
+            fmt.strip().lower() for fmt in image_formats_str.split(",") if fmt.strip()
+        )
+        undetectable = sorted(
+            fmt for fmt in image_formats if FORMAT_ALIASES.get(fmt, fmt) not in DETECTABLE_IMAGE_FORMATS
+        )
+        if undetectable:
+            print(f"Warning: ignoring SUPPORTED_IMAGE_FORMATS without content detection: {', '.join(undetectable)}")
+        self.SUPPORTED_IMAGE_FORMATS = image_formats.difference(undetectable)
+        # Canonical format names (as returned by content sniffing) for the same set
+        self.SUPPORTED_IMAGE_KINDS = frozenset(
+            FORMAT_ALIASES.get(fmt, fmt) for fmt in self.SUPPORTED_IMAGE_FORMATS
+        )
+        
+        # Precomputed lookups: extension -> file type, detected format -> file type
+        self._extension_types = {"pdf": "pdf"}
+        self._extension_types.update((fmt, "image") for fmt in self.SUPPORTED_IMAGE_FORMATS)
+        self._format_types = {"pdf": "pdf"}
+        self._format_types.update((kind, "image") for kind in self.SUPPORTED_IMAGE_KINDS)
         
         self.SUPPORTED_PDF_MAX_PAGES = int(os.getenv("SUPPORTED_PDF_MAX_PAGES", "50"))
+        self.SUPPORTED_IMAGE_MAX_FRAMES = int(os.getenv("SUPPORTED_IMAGE_MAX_FRAMES", "500"))
+        
+        # Pages (PDF pages or image frames) of one document OCR'd at the same time;
+        # this also bounds how many decoded pages a request holds in memory
+        self.OCR_PAGE_CONCURRENCY = max(1, int(os.getenv("OCR_PAGE_CONCURRENCY", "4")))
         
         # Server Configuration
         self.HOST = os.getenv("HOST", "0.0.0.0")
         self.PORT = int(os.getenv("PORT", "8000"))
         self.DEBUG = os.getenv("DEBUG", "true").lower() == "true"
+        self.WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+        # Reload watchers only make sense for a single development process
+        default_reload = "true" if self.DEBUG and self.WORKERS == 1 else "false"
+        self.RELOAD = os.getenv("RELOAD", default_reload).lower() == "true"
+        
+        # Shared state (cache and limiter) used by all workers on this host
+        self.STATE_DIR = os.getenv("STATE_DIR", os.path.join(tempfile.gettempdir(), "ocr-api"))
+        self.RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+        self.LM_STUDIO_MAX_CONCURRENCY = max(1, int(os.getenv("LM_STUDIO_MAX_CONCURRENCY", "4")))
+        
+        # Budget for uploads, decoded images and rendered pages held in memory
+        # by the whole server (0 disables it); requests wait this long for room
+        self.MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "1024"))
+        self.MEMORY_BUDGET_WAIT_SECONDS = float(os.getenv("MEMORY_BUDGET_WAIT_SECONDS", "30"))
+        # Each worker process enforces its share, so all of them together stay within it
+        self.MEMORY_BUDGET_BYTES = self.MEMORY_BUDGET_MB * 1024 * 1024 // self.WORKERS
+        
+        # Per-call token budgets and timeouts, derived from the size of the input
+        self.OCR_MIN_TOKENS = int(os.getenv("OCR_MIN_TOKENS", "256"))
+        self.OCR_MAX_TOKENS = int(os.getenv("OCR_MAX_TOKENS", "4096"))
+        self.OCR_TOKENS_PER_MEGAPIXEL = float(os.getenv("OCR_TOKENS_PER_MEGAPIXEL", "1000"))
+        self.OCR_TIMEOUT_BASE_SECONDS = float(os.getenv("OCR_TIMEOUT_BASE_SECONDS", "10"))
+        self.OCR_TIMEOUT_PER_1K_TOKENS = float(os.getenv("OCR_TIMEOUT_PER_1K_TOKENS", "25"))
+        self.OCR_MAX_TIMEOUT_SECONDS = float(os.getenv("OCR_MAX_TIMEOUT_SECONDS", "120"))
+        # How many times a truncated page may be halved and retried
+        self.OCR_MAX_SPLIT_DEPTH = int(os.getenv("OCR_MAX_SPLIT_DEPTH", "2"))
+        
+        # Fair scheduling of model calls: relative share per priority class, and
+        # API keys whose traffic is always treated as bulk ("batch")
+        self.SCHEDULER_INTERACTIVE_WEIGHT = float(os.getenv("SCHEDULER_INTERACTIVE_WEIGHT", "4"))
+        self.SCHEDULER_BATCH_WEIGHT = float(os.getenv("SCHEDULER_BATCH_WEIGHT", "1"))
+        batch_keys_str = os.getenv("BATCH_API_KEYS", "")
+        self.BATCH_API_KEYS = frozenset(key.strip() for key in batch_keys_str.split(",") if key.strip())
+        # Each worker's scheduler dispatches its share of the model slots, so the
+        # fair queue (not the unordered cross-worker limiter) decides who runs next
+        self.SCHEDULER_CONCURRENCY = max(1, self.LM_STUDIO_MAX_CONCURRENCY // self.WORKERS)
+        
+        # Send a tiny image through the model on startup before reporting ready
+        self.WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
     
-    def is_supported_image_format(self, filename: str) -> bool:
-        """Check if the file extension is a supported image format"""
+    @staticmethod
+    def get_extension(filename: str) -> str:
+        """Return the lower-cased extension of a filename ('' if none)"""
         if not filename:
-            return False
+            return ''
         
-        extension = filename.lower().split('.')[-1] if '.' in filename else ''
-        return extension in self.SUPPORTED_IMAGE_FORMATS
+        _, dot, extension = filename.rpartition('.')
+        return extension.lower() if dot else ''
+    
+    def is_supported_image_format(self, filename: str) -> bool:
+        """Check if the file extension is a supported image format"""
+        return self.get_file_type(filename) == "image"
     
     def is_pdf_file(self, filename: str) -> bool:
         """Check if the file is a PDF"""
-        if not filename:
-            return False
-        
-        extension = filename.lower().split('.')[-1] if '.' in filename else ''
-        return extension == 'pdf'
+        return self.get_extension(filename) == 'pdf'
     
     def is_supported_file(self, filename: str) -> bool:
         """Check if the file is supported (image or PDF)"""
-        return self.is_supported_image_format(filename) or self.is_pdf_file(filename)
+        return self.get_file_type(filename) != "unsupported"
     
     def get_file_type(self, filename: str) -> str:
-        """Get the file type category"""
-        if self.is_supported_image_format(filename):
-            return "image"
-        elif self.is_pdf_file(filename):
-            return "pdf"
-        else:
-            return "unsupported"
+        """Get the file type category from the filename extension"""
+        return self._extension_types.get(self.get_extension(filename), "unsupported")
+    
+    def get_format_file_type(self, detected_format: str) -> str:
+        """Get the file type category for a format detected from file content"""
+        return self._format_types.get(detected_format, "unsupported")
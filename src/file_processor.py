@@ -1,11 +1,40 @@
 """File processing utilities for handling images and PDFs"""
 import io
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
-from PIL import Image
-import fitz  # PyMuPDF
 from src.config import Config
 
+# PIL and PyMuPDF are imported on first use so that workers start quickly;
+# call FileProcessor.warm_up() to pay for the imports ahead of traffic.
+
+# Leading magic bytes of each format we can detect, checked in order
+MAGIC_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"II+\x00", "tiff"),  # BigTIFF
+    (b"MM\x00+", "tiff"),  # BigTIFF
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"%PDF-", "pdf"),
+)
+
+# Longest side of images sent to the model; larger images are downscaled
+MAX_IMAGE_DIMENSION = 2048
+
+# PIL plugin names for detected formats, so decoding skips format probing
+PIL_FORMATS = {
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "tiff": "TIFF",
+    "gif": "GIF",
+    "bmp": "BMP",
+    "webp": "WEBP",
+}
+
 class FileProcessor:
     """Handles processing of uploaded files (images and PDFs)"""
     
@@ -13,125 +42,347 @@ class FileProcessor:
         self.config = config
     
     async def validate_file(self, file: UploadFile) -> None:
-        """Validate uploaded file"""
+        """Validate uploaded file
+        
+        The extension is not checked: detect_format() accepts or rejects the
+        upload by its content.
+        """
         if not file.filename:
             raise HTTPException(status_code=400, detail="No filename provided")
         
-        if not self.config.is_supported_file(file.filename):
+        # Check file size (FastAPI provides content-length if available)
+        if hasattr(file, 'size') and file.size and file.size > self.config.MAX_FILE_SIZE_BYTES:
             raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file type. Supported formats: {', '.join(self.config.SUPPORTED_IMAGE_FORMATS)}, pdf"
+                status_code=413, 
+                detail=f"File too large. Maximum size: {self.config.MAX_FILE_SIZE_MB}MB"
             )
+    
+    async def read_file(self, file: UploadFile) -> bytes:
+        """Read the uploaded file and enforce the size limit
         
-        # Check file size (FastAPI provides content-length if available)
-        if hasattr(file, 'size') and file.size and file.size > self.config.MAX_FILE_SIZE_BYTES:
+        At most one byte past the limit is read, so an upload of unknown size
+        never takes more memory than was reserved for it.
+        """
+        content = await file.read(self.config.MAX_FILE_SIZE_BYTES + 1)
+        
+        # Validate file size after reading
+        if len(content) > self.config.MAX_FILE_SIZE_BYTES:
             raise HTTPException(
                 status_code=413, 
                 detail=f"File too large. Maximum size: {self.config.MAX_FILE_SIZE_MB}MB"
             )
+        return content
+    
+    @staticmethod
+    def sniff_format(content: bytes) -> Optional[str]:
+        """Identify the file format from its leading magic bytes"""
+        for signature, detected_format in MAGIC_SIGNATURES:
+            if content.startswith(signature):
+                return detected_format
+        
+        if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+            return "webp"
+        # PDF readers accept a header anywhere in the first kilobyte
+        if b"%PDF-" in content[:1024]:
+            return "pdf"
+        return None
     
-    async def process_image(self, file: UploadFile) -> Dict[str, Any]:
-        """Process image file and return image data"""
+    def detect_format(self, content: bytes) -> str:
+        """Detect the format of uploaded content, rejecting unsupported content
+        
+        This runs once per upload, before any decoding, so a mislabeled or
+        disguised file fails fast instead of reaching PIL or PyMuPDF.
+        """
+        detected_format = self.sniff_format(content)
+        if detected_format is None or self.config.get_format_file_type(detected_format) == "unsupported":
+            raise HTTPException(
+                status_code=400, 
+                detail=f"File content does not match a supported format. Supported formats: {self._supported_formats_text()}"
+            )
+        return detected_format
+    
+    def _supported_formats_text(self) -> str:
+        return f"{', '.join(sorted(self.config.SUPPORTED_IMAGE_FORMATS))}, pdf"
+    
+    async def process_image(self, content: bytes, detected_format: Optional[str] = None) -> Dict[str, Any]:
+        """Open image content and return its frames for OCR
+        
+        Frames are decoded lazily while iterating ``frames``, so multi-page
+        TIFFs and animated images only hold the frames currently in flight.
+        """
+        from PIL import Image
+        
         try:
-            # Read file content
-            content = await file.read()
+            # Validate that it's actually an image (reads the header only)
+            try:
+                pil_format = PIL_FORMATS.get(detected_format)
+                img = Image.open(io.BytesIO(content), formats=[pil_format] if pil_format else None)
+                frame_count = getattr(img, "n_frames", 1)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
             
-            # Validate file size after reading
-            if len(content) > self.config.MAX_FILE_SIZE_BYTES:
+            if frame_count > self.config.SUPPORTED_IMAGE_MAX_FRAMES:
+                img.close()
                 raise HTTPException(
-                    status_code=413, 
-                    detail=f"File too large. Maximum size: {self.config.MAX_FILE_SIZE_MB}MB"
+                    status_code=400, 
+                    detail=f"Image has too many frames. Maximum frames: {self.config.SUPPORTED_IMAGE_MAX_FRAMES}"
                 )
             
-            # Validate that it's actually an image
-            try:
-                with Image.open(io.BytesIO(content)) as img:
-                    # Convert to RGB if necessary (for JPEG compatibility)
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        img = img.convert('RGB')
-                    
-                    # Resize if image is too large (optional optimization)
-                    max_dimension = 2048
-                    if max(img.size) > max_dimension:
-                        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
-                    
-                    # Save processed image to bytes
-                    output_buffer = io.BytesIO()
-                    img.save(output_buffer, format='JPEG', quality=85)
-                    processed_content = output_buffer.getvalue()
-                    
-                    return {
-                        "data": processed_content,
-                        "format": img.format or "JPEG",
-                        "size": img.size,
-                        "mode": img.mode
-                    }
-                    
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+            return {
+                "format": img.format or "JPEG",
+                "size": img.size,
+                "mode": img.mode,
+                "frame_count": frame_count,
+                "page_bytes": self._estimate_frame_bytes(img.size, len(img.getbands())),
+                "frames": self._iter_frames(img)
+            }
                 
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
     
-    async def process_pdf(self, file: UploadFile) -> Dict[str, Any]:
-        """Process PDF file and extract text/images"""
+    def _iter_frames(self, img) -> Iterator[Dict[str, Any]]:
+        """Yield each frame of an opened image as OCR-ready JPEG data"""
+        from PIL import ImageSequence
+        
         try:
-            # Read file content
-            content = await file.read()
+            for index, frame in enumerate(ImageSequence.Iterator(img)):
+                started = time.perf_counter()
+                try:
+                    encoded = self._encode_frame(frame)
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid image file: {str(e)}")
+                
+                encoded.update(
+                    page=index + 1,
+                    source="ocr",
+                    timings={"decode": round(time.perf_counter() - started, 3)}
+                )
+                yield encoded
+        finally:
+            img.close()
+    
+    @staticmethod
+    def _estimate_frame_bytes(size: Tuple[float, float], bands: int) -> int:
+        """Peak bytes needed to decode, convert and encode one frame or page
+        
+        Covers the decoded source, an RGB working copy and the JPEG output
+        (budgeted at a quarter of the RGB size).
+        """
+        pixels = int(size[0] * size[1])
+        return pixels * bands + pixels * 3 + pixels * 3 // 4
+    
+    def _encode_frame(self, frame) -> Dict[str, Any]:
+        """Convert, downscale and JPEG-encode a single frame"""
+        from PIL import Image
+        
+        # Work on an independent copy so the source can seek to the next frame
+        # (and convert to RGB if necessary, for JPEG compatibility)
+        if frame.mode in ('RGB', 'L'):
+            img = frame.copy()
+        else:
+            img = frame.convert('RGB')
+        
+        # Resize if image is too large (optional optimization)
+        if max(img.size) > MAX_IMAGE_DIMENSION:
+            img.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.Resampling.LANCZOS)
+        
+        # Save processed image to bytes
+        output_buffer = io.BytesIO()
+        img.save(output_buffer, format='JPEG', quality=85)
+        return {
+            "data": output_buffer.getvalue(),
+            "size": img.size,
+            "mode": img.mode,
+            "density": self._estimate_density(img)
+        }
+    
+    @staticmethod
+    def _estimate_density(img) -> float:
+        """Estimate how much of the image is ink (fraction of dark pixels)"""
+        from PIL import Image
+        
+        # Sample pixels rather than average them: averaging blurs thin text
+        # strokes into light grey, which the threshold below would not count
+        scale = max(1, max(img.size) // 512)
+        preview = img.resize(
+            (max(1, img.width // scale), max(1, img.height // scale)),
+            Image.Resampling.NEAREST
+        ).convert('L')
+        histogram = preview.histogram()
+        return round(sum(histogram[:128]) / max(1, sum(histogram)), 3)
+    
+    def split_image(self, image_data: bytes) -> List[Dict[str, Any]]:
+        """Split an encoded page into top and bottom halves for a retry
+        
+        The halves overlap slightly so a line of text on the cut is read
+        whole by at least one of them.
+        """
+        from PIL import Image
+        
+        with Image.open(io.BytesIO(image_data)) as img:
+            width, height = img.size
+            if height < 64:
+                return []
             
-            # Validate file size
-            if len(content) > self.config.MAX_FILE_SIZE_BYTES:
+            overlap = max(8, height // 50)
+            middle = height // 2
+            return [
+                self._encode_frame(img.crop((0, 0, width, middle + overlap))),
+                self._encode_frame(img.crop((0, middle - overlap, width, height)))
+            ]
+    
+    async def process_pdf(self, content: bytes) -> Dict[str, Any]:
+        """Open PDF content and return its pages for per-page processing
+        
+        Pages are classified and decoded lazily while iterating ``pages``: a
+        page with extractable text yields ``source: "text"``, any other page is
+        rendered to an image and yields ``source: "ocr"``.
+        """
+        import fitz  # PyMuPDF
+        
+        try:
+            pdf_doc = fitz.open(stream=content, filetype="pdf")
+            if len(pdf_doc) > self.config.SUPPORTED_PDF_MAX_PAGES:
+                pdf_doc.close()
                 raise HTTPException(
-                    status_code=413, 
-                    detail=f"File too large. Maximum size: {self.config.MAX_FILE_SIZE_MB}MB"
+                    status_code=400, 
+                    detail=f"PDF too long. Maximum pages: {self.config.SUPPORTED_PDF_MAX_PAGES}"
                 )
             
-            # Process PDF
-            with fitz.open(stream=content, filetype="pdf") as pdf_doc:
-                if len(pdf_doc) > self.config.SUPPORTED_PDF_MAX_PAGES:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"PDF too long. Maximum pages: {self.config.SUPPORTED_PDF_MAX_PAGES}"
-                    )
-                
-                # Try to extract text first (for text-based PDFs)
-                text_content = ""
-                images = []
-                
-                for page_num in range(len(pdf_doc)):
-                    page = pdf_doc[page_num]
-                    
-                    # Extract text
-                    page_text = page.get_text().strip()
-                    if page_text:
-                        text_content += f"\n--- Page {page_num + 1} ---\n{page_text}"
-                    
-                    # If no text found, convert page to image for OCR
-                    if not page_text:
-                        # Render page as image
-                        mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
-                        pix = page.get_pixmap(matrix=mat)
-                        img_data = pix.tobytes("jpeg")
-                        
-                        images.append({
-                            "page": page_num + 1,
-                            "data": img_data
-                        })
-                
-                return {
-                    "text_content": text_content.strip(),
-                    "images": images,
-                    "page_count": len(pdf_doc),
-                    "has_text": bool(text_content.strip())
-                }
+            # Size the memory reservation for the largest page, rendered at 2x
+            width, height = max(
+                ((page.rect.width, page.rect.height) for page in pdf_doc),
+                key=lambda size: size[0] * size[1],
+                default=(0, 0)
+            )
+            
+            return {
+                "page_count": len(pdf_doc),
+                "page_bytes": self._estimate_frame_bytes((2 * width, 2 * height), 3),
+                "pages": self._iter_pdf_pages(pdf_doc)
+            }
                 
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
     
+    def _iter_pdf_pages(self, pdf_doc) -> Iterator[Dict[str, Any]]:
+        """Yield each PDF page as extracted text or as a rendered image"""
+        import fitz  # PyMuPDF
+        
+        try:
+            for page_num in range(len(pdf_doc)):
+                started = time.perf_counter()
+                page = pdf_doc[page_num]
+                
+                # Extract text
+                page_text = page.get_text().strip()
+                if page_text:
+                    yield {
+                        "page": page_num + 1,
+                        "source": "text",
+                        "text": page_text,
+                        "timings": {"extract": round(time.perf_counter() - started, 3)}
+                    }
+                    continue
+                
+                # No text found: a scanned page that is one embedded JPEG is
+                # sent as-is, without rasterizing and re-encoding it
+                embedded = self._extract_page_jpeg(pdf_doc, page)
+                if embedded is not None:
+                    embedded.update(
+                        page=page_num + 1,
+                        source="ocr",
+                        timings={"extract_image": round(time.perf_counter() - started, 3)}
+                    )
+                    yield embedded
+                    continue
+                
+                # Otherwise render page as image for OCR
+                mat = fitz.Matrix(2.0, 2.0)  # 2x zoom for better quality
+                pix = page.get_pixmap(matrix=mat)
+                img_data = pix.tobytes("jpeg")
+                
+                yield {
+                    "page": page_num + 1,
+                    "source": "ocr",
+                    "data": img_data,
+                    "size": (pix.width, pix.height),
+                    "timings": {"render": round(time.perf_counter() - started, 3)}
+                }
+        finally:
+            pdf_doc.close()
+    
+    def _extract_page_jpeg(self, pdf_doc, page) -> Optional[Dict[str, Any]]:
+        """Return the page's image data if the page is a single full-page JPEG
+        
+        Returns None (so the caller rasterizes) for anything that the
+        embedded stream would not show faithfully: several images, a soft
+        mask, an image that doesn't cover the page or extends past it or its
+        crop box, a rotated or flipped
+        placement, annotations, vector content drawn with it (redaction
+        boxes, stamps, signatures, form lines), form XObjects, or a non-JPEG
+        or CMYK image.
+        """
+        if page.rotation or page.first_annot is not None:
+            return None
+        if page.get_drawings() or page.get_xobjects():
+            return None
+        
+        images = page.get_images(full=True)
+        if len(images) != 1:
+            return None
+        xref, smask = images[0][0], images[0][1]
+        if smask:
+            return None
+        
+        placements = page.get_image_rects(xref, transform=True)
+        if len(placements) != 1:
+            return None
+        rect, matrix = placements[0]
+        # Upright, unflipped placement covering (nearly) the whole page
+        if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+            return None
+        # The image must fill the page, and the page must show (nearly) all of
+        # the image: content hidden by the page bounds or a crop box is not OCR'd
+        if page.cropbox != page.mediabox:
+            return None
+        visible = (rect & page.rect).get_area()
+        if visible < 0.9 * page.rect.get_area() or visible < 0.9 * rect.get_area():
+            return None
+        
+        image = pdf_doc.extract_image(xref)
+        if not image or image.get("ext") not in ("jpeg", "jpg") or image.get("colorspace") == 4:
+            return None
+        
+        width, height = image["width"], image["height"]
+        if max(width, height) <= MAX_IMAGE_DIMENSION:
+            return {
+                "data": image["image"],
+                "size": (width, height),
+                "density": None
+            }
+        
+        # Too large: let the JPEG decoder skip detail down to about the size
+        # the page would have been rendered at, then downscale the rest
+        from PIL import Image
+        
+        with Image.open(io.BytesIO(image["image"]), formats=["JPEG"]) as img:
+            img.draft(img.mode, (int(2 * page.rect.width), int(2 * page.rect.height)))
+            return self._encode_frame(img)
+    
+    def warm_up(self) -> bytes:
+        """Import the image/PDF decoders and return a tiny JPEG for model warm-up"""
+        import fitz  # noqa: F401 - imported for its side effect of loading PyMuPDF
+        from PIL import Image
+        
+        output_buffer = io.BytesIO()
+        Image.new('RGB', (64, 32), color='white').save(output_buffer, format='JPEG', quality=85)
+        return output_buffer.getvalue()
+    
     async def get_file_info(self, file: UploadFile) -> Dict[str, Any]:
         """Get basic information about the file"""
         return {
@@ -1,8 +1,21 @@
 """LM Studio client for communicating with LM Studio API"""
-import aiohttp
-import base64
-from typing import Dict, List, Any
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Any, Iterator, Optional
 from src.config import Config
+from src.payload import VisionPayloadBuilder
+from src.shared_state import SharedLimiter
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# aiohttp is imported lazily (in startup()) to keep worker start-up cheap
+
+OCR_PROMPT = "Please extract all text from this image. Return only the extracted text without any additional formatting or commentary."
+
+
+async def _aiter(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """Adapt a lazy chunk iterator for aiohttp's streaming request body"""
+    for chunk in chunks:
+        yield chunk
 
 class LMStudioClient:
     """Client for communicating with LM Studio API"""
@@ -12,59 +25,68 @@ class LMStudioClient:
         self.base_url = config.LM_STUDIO_BASE_URL.rstrip('/')
         self.api_key = config.LM_STUDIO_API_KEY
         self.model_name = config.LM_STUDIO_MODEL_NAME
+        self.vision_payload = VisionPayloadBuilder(self.model_name, OCR_PROMPT)
+        self.limiter = SharedLimiter(config.STATE_DIR, "lm-studio", config.LM_STUDIO_MAX_CONCURRENCY)
+        self._session: Optional["aiohttp.ClientSession"] = None
+    
+    async def startup(self) -> None:
+        """Create the per-worker connection pool (call after fork)"""
+        import aiohttp
         
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.config.LM_STUDIO_MAX_CONCURRENCY)
+            self._session = aiohttp.ClientSession(connector=connector)
     
-    async def process_image_ocr(self, image_data: bytes, filename: str) -> Dict[str, Any]:
-        """Process image for OCR using LM Studio"""
+    async def shutdown(self) -> None:
+        """Close the per-worker connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def _get_session(self) -> "aiohttp.ClientSession":
+        """Return the worker's session, creating it if startup() was not run"""
+        if self._session is None or self._session.closed:
+            await self.startup()
+        return self._session
+    
+    async def process_image_ocr(self, image_data: bytes, filename: str, max_tokens: int = 2000,
+                                timeout: float = 60.0) -> Dict[str, Any]:
+        """Process image for OCR using LM Studio
+        
+        ``truncated`` in the result is set when the model stopped at
+        ``max_tokens`` rather than at the end of the text.
+        """
+        import aiohttp
+        
         try:
-            # Convert image to base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
+            # Stream the request body: cached JSON framing around base64 chunks
+            body_length, body_chunks = self.vision_payload.build(image_data, max_tokens=max_tokens)
             
-            # Prepare the request payload for vision model
-            payload = {
-                "model": self.model_name,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Please extract all text from this image. Return only the extracted text without any additional formatting or commentary."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "temperature": 0.1,
-                "max_tokens": 2000
-            }
+            session = await self._get_session()
+            headers = self._get_headers()
+            headers["Content-Type"] = "application/json"
+            headers["Content-Length"] = str(body_length)
             
-            async with aiohttp.ClientSession() as session:
-                headers = self._get_headers()
-                headers["Content-Type"] = "application/json"
-                
+            async with self.limiter.slot():
                 async with session.post(
                     f"{self.base_url}/v1/chat/completions",
                     headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=60)
+                    data=_aiter(body_chunks),
+                    timeout=aiohttp.ClientTimeout(total=timeout)
                 ) as response:
                     if response.status == 200:
                         result = await response.json()
                         
                         # Extract text from response
                         if "choices" in result and len(result["choices"]) > 0:
-                            extracted_text = result["choices"][0]["message"]["content"].strip()
+                            choice = result["choices"][0]
+                            extracted_text = choice["message"]["content"].strip()
                             
                             return {
                                 "text": extracted_text,
                                 "confidence": 0.9,  # Default confidence for now
-                                "model_used": self.model_name
+                                "model_used": self.model_name,
+                                "truncated": choice.get("finish_reason") == "length"
                             }
                         else:
                             raise Exception("No response from model")
@@ -75,8 +97,11 @@ class LMStudioClient:
         except Exception as e:
             raise Exception(f"OCR processing failed: {str(e)}")
     
-    async def process_text_ocr(self, text_content: str) -> Dict[str, Any]:
+    async def process_text_ocr(self, text_content: str, max_tokens: int = 2000,
+                               timeout: float = 30.0) -> Dict[str, Any]:
         """Process text content that was pre-extracted from PDF"""
+        import aiohttp
+        
         try:
             # For PDFs that already have text, we might want to clean it up
             # using the model, or just return it as-is
@@ -89,29 +114,32 @@ class LMStudioClient:
                     }
                 ],
                 "temperature": 0.1,
-                "max_tokens": 2000
+                "max_tokens": max_tokens
             }
             
-            async with aiohttp.ClientSession() as session:
-                headers = self._get_headers()
-                headers["Content-Type"] = "application/json"
-                
+            session = await self._get_session()
+            headers = self._get_headers()
+            headers["Content-Type"] = "application/json"
+            
+            async with self.limiter.slot():
                 async with session.post(
                     f"{self.base_url}/v1/chat/completions",
                     headers=headers,
                     json=payload,
-                    timeout=aiohttp.ClientTimeout(total=30)
+                    timeout=aiohttp.ClientTimeout(total=timeout)
                 ) as response:
                     if response.status == 200:
                         result = await response.json()
                         
                         if "choices" in result and len(result["choices"]) > 0:
-                            cleaned_text = result["choices"][0]["message"]["content"].strip()
+                            choice = result["choices"][0]
+                            cleaned_text = choice["message"]["content"].strip()
                             
                             return {
                                 "text": cleaned_text,
                                 "confidence": 0.95,  # Higher confidence for text cleanup
-                                "model_used": self.model_name
+                                "model_used": self.model_name,
+                                "truncated": choice.get("finish_reason") == "length"
                             }
                         else:
                             # Fallback to original text if model fails
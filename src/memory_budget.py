@@ -0,0 +1,116 @@
+"""Process-wide memory budget for in-flight uploads, decoded images and pages"""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+from fastapi import HTTPException
+
+
+class MemoryBudget:
+    """Byte budget that preprocessing reserves from before decoding or rendering
+
+    Reservations are granted in arrival order. A caller that cannot get its
+    bytes within ``wait_seconds`` is rejected with a 503 instead of pushing
+    the process towards an OOM kill. A single reservation larger than the
+    whole budget is clamped to it, so it can still run on its own.
+    A ``total_bytes`` of 0 disables the budget.
+
+    Callers must not wait for a reservation while holding another one: a
+    request reserves everything it needs to make progress at once, and takes
+    anything beyond that with try_acquire().
+    """
+
+    def __init__(self, total_bytes: int, wait_seconds: float):
+        self.total_bytes = total_bytes
+        self.wait_seconds = wait_seconds
+        self.used = 0
+        self.peak = 0
+        self.rejected = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def enabled(self) -> bool:
+        return self.total_bytes > 0
+
+    async def acquire(self, nbytes: int) -> int:
+        """Reserve nbytes, waiting for room; return the amount to release later"""
+        if not self.enabled or nbytes <= 0:
+            return 0
+
+        nbytes = min(nbytes, self.total_bytes)
+        if not self._waiters and self.used + nbytes <= self.total_bytes:
+            self._take(nbytes)
+            return nbytes
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (nbytes, future)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.wait_seconds)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._waiters.remove(entry)
+                self.rejected += 1
+                # The head of the queue may have been what blocked smaller requests
+                self._grant_waiters()
+                raise HTTPException(status_code=503, detail="Server is busy, please retry later")
+        except asyncio.CancelledError:
+            if future.done():
+                self.release(nbytes)
+            else:
+                self._waiters.remove(entry)
+                self._grant_waiters()
+            raise
+        return nbytes
+
+    def try_acquire(self, nbytes: int) -> Optional[int]:
+        """Reserve nbytes only if that is possible right now, without queueing
+        
+        Returns the amount to release later, or None if there is no room or
+        others are already waiting.
+        """
+        if not self.enabled or nbytes <= 0:
+            return 0
+
+        nbytes = min(nbytes, self.total_bytes)
+        if self._waiters or self.used + nbytes > self.total_bytes:
+            return None
+        self._take(nbytes)
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        """Return bytes taken with acquire()"""
+        if nbytes <= 0:
+            return
+        self.used -= nbytes
+        self._grant_waiters()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int):
+        """Hold a reservation for the duration of the block"""
+        reserved = await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(reserved)
+
+    def _take(self, nbytes: int) -> None:
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def _grant_waiters(self) -> None:
+        while self._waiters and self.used + self._waiters[0][0] <= self.total_bytes:
+            nbytes, future = self._waiters.popleft()
+            self._take(nbytes)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current and peak use of the budget"""
+        return {
+            "enabled": self.enabled,
+            "total_bytes": self.total_bytes,
+            "used_bytes": self.used,
+            "peak_bytes": self.peak,
+            "waiting": len(self._waiters),
+            "rejected": self.rejected
+        }
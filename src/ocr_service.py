@@ -1,127 +1,436 @@
 """OCR service that coordinates file processing and model inference"""
-from typing import Dict, Any
+import asyncio
+import functools
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, Any, Iterator, List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
+from src.budget import TokenBudget
 from src.lm_studio_client import LMStudioClient
+from src.memory_budget import MemoryBudget
 from src.file_processor import FileProcessor
+from src.scheduler import OCRScheduler, INTERACTIVE
+from src.shared_state import SharedCache
+
+def simple_error_message(error: Exception, default: str) -> str:
+    """Map an exception to a simple message that is safe to return to clients
+    
+    The raw exception text (hosts, upstream response bodies) is only logged.
+    Messages produced here map to themselves, so they can be re-raised.
+    """
+    message = str(error).lower()
+    if "connect" in message or "connection" in message or "unavailable" in message:
+        return "OCR service unavailable"
+    elif "timeout" in message:
+        return "Processing timeout"
+    elif "model" in message:
+        return "OCR model error"
+    return default
 
 class OCRService:
     """Service that orchestrates OCR processing"""
     
-    def __init__(self, lm_studio_client: LMStudioClient, file_processor: FileProcessor):
+    def __init__(self, lm_studio_client: LMStudioClient, file_processor: FileProcessor,
+                 cache: Optional[SharedCache] = None, scheduler: Optional[OCRScheduler] = None,
+                 memory_budget: Optional[MemoryBudget] = None):
         self.lm_studio_client = lm_studio_client
         self.file_processor = file_processor
+        self.cache = cache
+        self.scheduler = scheduler
+        # Without a budget, reservations are free (a disabled budget)
+        self.memory_budget = memory_budget or MemoryBudget(0, 0)
+        self.token_budget = TokenBudget(file_processor.config)
     
-    async def process_file(self, file: UploadFile) -> Dict[str, Any]:
-        """Process uploaded file and extract text using OCR"""
+    async def warm_up(self) -> None:
+        """Load decoders and send a tiny image through the model"""
+        image_data = await asyncio.to_thread(self.file_processor.warm_up)
+        await self.lm_studio_client.process_image_ocr(image_data, "warmup.jpg")
+    
+    async def process_file(self, file: UploadFile, client_id: str = "anonymous",
+                           priority: str = INTERACTIVE) -> Dict[str, Any]:
+        """Process uploaded file and extract text using OCR
+        
+        ``client_id`` and ``priority`` place the file's pages in the
+        scheduler's fair queue, if one is configured.
+        """
         
-        # Validate file first
+        # Validate file first (name and declared size)
         await self.file_processor.validate_file(file)
         
-        # Get file info
-        file_info = await self.file_processor.get_file_info(file)
-        file_type = file_info["file_type"]
+        # Nothing is read or parsed before its bytes are reserved: the upload is
+        # sized by the spooled file Starlette already holds, or by the limit
+        upload_bytes = file.size if file.size is not None else self.file_processor.config.MAX_FILE_SIZE_BYTES
+        reserved = await self.memory_budget.acquire(upload_bytes)
+        try:
+            content = await self.file_processor.read_file(file)
+            
+            # The content, not the extension, decides how the file is processed;
+            # the detected format is carried through to the decoder
+            detected_format = self.file_processor.detect_format(content)
+            file_type = self.file_processor.config.get_format_file_type(detected_format)
+            
+            # Identical uploads are served from the cache shared by all workers
+            cache_key = None
+            if self.cache is not None and self.cache.enabled:
+                digest = hashlib.sha256(content).hexdigest()
+                cache_key = f"{self.lm_studio_client.model_name}:{file_type}:{digest}"
+                cached = await self.cache.aget(cache_key)
+                if cached is not None:
+                    return cached
+            
+            # The upload stays in memory until the request finishes; it is
+            # admitted together with its first page, so it can always progress
+            document = await self._open_document(content, file_type, detected_format)
+            page_bytes = document["page_bytes"]
+            page_reserved = self.memory_budget.try_acquire(page_bytes)
+            if page_reserved is None:
+                # Waiting for the page while holding the upload could leave the
+                # budget full of requests that cannot progress: give everything
+                # back and wait for both at once, with nothing read
+                del content, document
+                self.memory_budget.release(reserved)
+                reserved = 0
+                reserved = await self.memory_budget.acquire(upload_bytes + page_bytes)
+                await file.seek(0)
+                content = await self.file_processor.read_file(file)
+                document = await self._open_document(content, file_type, detected_format)
+            else:
+                reserved += page_reserved
+            
+            if file_type == "image":
+                result = await self._process_image_file(document, file.filename, client_id, priority)
+            else:
+                result = await self._process_pdf_file(document, file.filename, client_id, priority)
+        finally:
+            self.memory_budget.release(reserved)
         
+        if cache_key is not None and self._is_cacheable(result):
+            await self.cache.aset(cache_key, result)
+        return result
+    
+    @staticmethod
+    def _is_cacheable(result: Dict[str, Any]) -> bool:
+        """Only complete results are cached, so a transient failure is not replayed"""
+        return not any(
+            page.get("error") or page.get("truncated") or page.get("fallback")
+            for page in result.get("pages", [])
+        )
+    
+    async def _open_document(self, content: bytes, file_type: str,
+                             detected_format: Optional[str]) -> Dict[str, Any]:
+        """Open an image or PDF; frames and pages are decoded lazily by the page pipeline"""
         if file_type == "image":
-            return await self._process_image_file(file)
-        elif file_type == "pdf":
-            return await self._process_pdf_file(file)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file_type}")
+            return await self.file_processor.process_image(content, detected_format)
+        return await self.file_processor.process_pdf(content)
     
-    async def _process_image_file(self, file: UploadFile) -> Dict[str, Any]:
-        """Process image file for OCR"""
+    async def _process_image_file(self, image_data: Dict[str, Any], filename: Optional[str],
+                                  client_id: str = "anonymous", priority: str = INTERACTIVE) -> Dict[str, Any]:
+        """OCR every frame of an opened image; the first frame is already reserved"""
         try:
-            # Process the image
-            image_data = await self.file_processor.process_image(file)
-            
-            # Send to LM Studio for OCR
-            ocr_result = await self.lm_studio_client.process_image_ocr(
-                image_data["data"], 
-                file.filename or "image"
-            )
-            
-            return {
-                "text": ocr_result["text"],
-                "confidence": ocr_result["confidence"],
-                "file_type": "image",
-                "image_info": {
-                    "format": image_data["format"],
-                    "size": image_data["size"],
-                    "mode": image_data["mode"]
-                },
-                "model_used": ocr_result.get("model_used")
-            }
+            pages = await self._ocr_pages(image_data["frames"], filename or "image", client_id, priority,
+                                          image_data["page_bytes"], page_reserved=True)
+            return self._build_image_result(image_data, pages)
             
         except HTTPException:
             raise
         except Exception as e:
-            # Provide simple error messages
-            error_message = "Image processing failed"
-            if "connect" in str(e).lower() or "connection" in str(e).lower():
-                error_message = "OCR service unavailable"
-            elif "timeout" in str(e).lower():
-                error_message = "Processing timeout"
-            elif "model" in str(e).lower():
-                error_message = "OCR model error"
-            raise HTTPException(status_code=500, detail=error_message)
-    
-    async def _process_pdf_file(self, file: UploadFile) -> Dict[str, Any]:
-        """Process PDF file for OCR"""
+            # Provide simple error messages; the details only go to the log
+            print(f"Image processing failed: {str(e)}")
+            raise HTTPException(status_code=500, detail=simple_error_message(e, "Image processing failed"))
+    
+    async def _process_pdf_file(self, pdf_data: Dict[str, Any], filename: Optional[str],
+                                client_id: str = "anonymous", priority: str = INTERACTIVE) -> Dict[str, Any]:
+        """OCR an opened PDF, routing each page to text cleanup or OCR; the first page is already reserved"""
         try:
-            # Process the PDF
-            pdf_data = await self.file_processor.process_pdf(file)
+            pages = await self._ocr_pages(pdf_data["pages"], filename or "document", client_id, priority,
+                                          pdf_data["page_bytes"], page_reserved=True)
+            return self._build_pdf_result(pdf_data, pages)
             
-            combined_text = ""
-            confidence_scores = []
-            
-            # If PDF has extractable text, process it
-            if pdf_data["has_text"]:
-                text_result = await self.lm_studio_client.process_text_ocr(pdf_data["text_content"])
-                combined_text += text_result["text"]
-                confidence_scores.append(text_result["confidence"])
+        except HTTPException:
+            raise
+        except Exception as e:
+            # Provide simple error messages; the details only go to the log
+            print(f"PDF processing failed: {str(e)}")
+            raise HTTPException(status_code=500, detail=simple_error_message(e, "PDF processing failed"))
+    
+    async def process_pages(self, file_type: str, info: Dict[str, Any], pages: Iterator[Dict[str, Any]],
+                            filename: str, client_id: str = "anonymous",
+                            priority: str = INTERACTIVE) -> Dict[str, Any]:
+        """OCR pages that were already decoded elsewhere and assemble the result
+        
+        ``pages`` are the items yielded by FileProcessor's page iterators and
+        ``info`` is the rest of process_image()/process_pdf()'s return value.
+        This lets batch tools decode in a process pool and only dispatch model
+        calls here; errors are raised as-is rather than mapped to HTTP errors.
+        """
+        results = await self._ocr_pages(pages, filename, client_id, priority)
+        if file_type == "image":
+            return self._build_image_result(info, results)
+        return self._build_pdf_result(info, results)
+    
+    def _build_image_result(self, image_data: Dict[str, Any], pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Assemble the result for an image from its per-frame results"""
+        # Fail only if no frame could be processed
+        succeeded = [page for page in pages if "error" not in page]
+        if not succeeded:
+            raise Exception(pages[0]["error"] if pages else "Image has no frames")
+        
+        if len(pages) == 1:
+            text = pages[0]["text"]
+        else:
+            text = "\n\n".join(
+                f"--- Page {page['page']} ---\n{page['text']}"
+                for page in succeeded if page["text"].strip()
+            )
+        
+        return {
+            "text": text,
+            "confidence": sum(page["confidence"] for page in succeeded) / len(succeeded),
+            "file_type": "image",
+            "image_info": {
+                "format": image_data["format"],
+                "size": image_data["size"],
+                "mode": image_data["mode"],
+                "frame_count": image_data["frame_count"]
+            },
+            "pages": pages,
+            "model_used": self.lm_studio_client.model_name
+        }
+    
+    def _build_pdf_result(self, pdf_data: Dict[str, Any], pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Reassemble a PDF in true page order from its per-page results"""
+        # Failed pages are left out, unless nothing could be processed at all
+        succeeded = [page for page in pages if "error" not in page]
+        if pages and not succeeded:
+            raise Exception(pages[0]["error"])
+        
+        combined_text = "\n\n".join(
+            f"--- Page {page['page']}{' (OCR)' if page['source'] == 'ocr' else ''} ---\n{page['text']}"
+            for page in succeeded if page["text"].strip()
+        )
+        
+        # Calculate average confidence
+        avg_confidence = sum(page["confidence"] for page in succeeded) / len(succeeded) if succeeded else 0.0
+        
+        return {
+            "text": combined_text,
+            "confidence": avg_confidence,
+            "file_type": "pdf",
+            "pdf_info": {
+                "page_count": pdf_data["page_count"],
+                "has_extractable_text": any(page["source"] == "text" for page in pages),
+                "scanned_pages": sum(1 for page in pages if page["source"] == "ocr"),
+                "failed_pages": len(pages) - len(succeeded)
+            },
+            "pages": pages
+        }
+    
+    async def _ocr_pages(self, pages: Iterator[Dict[str, Any]], filename: str,
+                         client_id: str = "anonymous", priority: str = INTERACTIVE,
+                         page_bytes: int = 0, page_reserved: bool = False) -> List[Dict[str, Any]]:
+        """Process a lazy sequence of pages concurrently
+        
+        Pages with ``source: "text"`` go through text cleanup, all others
+        through image OCR. At most OCR_PAGE_CONCURRENCY pages are decoded or in
+        flight at once: the next page is only pulled from the iterator (in a
+        thread, since that is where decoding happens) after a slot frees up
+        and ``page_bytes`` have been reserved from the memory budget. With
+        ``page_reserved``, the caller already holds one page's reservation:
+        pages use it in turn and only run alongside it when the budget has
+        room right now, so the request never queues for memory while holding
+        memory.
+        Each page is a separate job for the scheduler, so pages of large
+        documents interleave with other clients' work. Results come back in
+        page order as ``{page, source, text, confidence, timings}``; a page
+        that fails carries an ``error`` instead of text.
+        """
+        slots = asyncio.Semaphore(self.file_processor.config.OCR_PAGE_CONCURRENCY)
+        tasks = []
+        
+        async def process_page(page: Dict[str, Any]) -> Dict[str, Any]:
+            timings = dict(page.get("timings", {}))
+            result = {"page": page["page"], "source": page["source"]}
+            started = time.perf_counter()
+            context = {"client_id": client_id, "priority": priority, "queue": 0.0}
             
-            # Process any scanned pages (images)
-            for image_info in pdf_data["images"]:
-                try:
-                    ocr_result = await self.lm_studio_client.process_image_ocr(
-                        image_info["data"], 
-                        f"{file.filename}_page_{image_info['page']}"
+            try:
+                if page["source"] == "text":
+                    ocr_result = await self._ocr_text(page["text"], context)
+                else:
+                    ocr_result = await self._ocr_image(
+                        page["data"], page.get("size"), page.get("density"),
+                        f"{filename}_page_{page['page']}", context
                     )
-                    
-                    if ocr_result["text"].strip():
-                        if combined_text:
-                            combined_text += f"\n\n--- Page {image_info['page']} (OCR) ---\n"
-                        combined_text += ocr_result["text"]
-                        confidence_scores.append(ocr_result["confidence"])
-                        
-                except Exception as e:
-                    # Log error but continue with other pages
-                    print(f"Failed to OCR page {image_info['page']}: {str(e)}")
-                    continue
+                result.update(text=ocr_result["text"], confidence=ocr_result["confidence"])
+                if ocr_result.get("truncated"):
+                    result["truncated"] = True
+                if ocr_result.get("model_used") == "fallback":
+                    # The model could not be reached; this is the raw extracted text
+                    result["fallback"] = True
+            except Exception as e:
+                # Log error but continue with other pages
+                print(f"Failed to OCR page {page['page']}: {str(e)}")
+                result.update(text="", confidence=0.0, error=simple_error_message(e, "Page processing failed"))
             
-            # Calculate average confidence
-            avg_confidence = sum(confidence_scores) / len(confidence_scores) if confidence_scores else 0.0
-            
-            return {
-                "text": combined_text.strip(),
-                "confidence": avg_confidence,
-                "file_type": "pdf",
-                "pdf_info": {
-                    "page_count": pdf_data["page_count"],
-                    "has_extractable_text": pdf_data["has_text"],
-                    "scanned_pages": len(pdf_data["images"])
-                }
-            }
-            
-        except HTTPException:
+            if self.scheduler is not None:
+                timings["queue"] = round(context["queue"], 3)
+            timings["ocr"] = round(time.perf_counter() - started - context["queue"], 3)
+            result["timings"] = timings
+            return result
+        
+        # The page reservation held by the caller, handed from page to page
+        own_reservation = asyncio.Semaphore(1 if page_reserved else 0)
+        
+        def release(reserved: Optional[int], _task: Optional[asyncio.Task] = None) -> None:
+            # The memory goes back before the slot, so the next page can reserve it
+            if reserved is None:
+                own_reservation.release()
+            else:
+                self.memory_budget.release(reserved)
+            slots.release()
+        
+        async def reserve() -> Optional[int]:
+            """Reserve memory for the next page; None means the caller's reservation"""
+            if not page_reserved:
+                return await self.memory_budget.acquire(page_bytes)
+            if not own_reservation.locked():
+                await own_reservation.acquire()
+                return None
+            reserved = self.memory_budget.try_acquire(page_bytes)
+            if reserved is None:
+                await own_reservation.acquire()
+            return reserved
+        
+        try:
+            while True:
+                await slots.acquire()
+                reserved = 0
+                try:
+                    reserved = await reserve()
+                    page = await asyncio.to_thread(next, pages, None)
+                except BaseException:
+                    release(reserved)
+                    raise
+                if page is None:
+                    release(reserved)
+                    break
+                task = asyncio.create_task(process_page(page))
+                # Released when the task ends, even if it is cancelled before it starts
+                task.add_done_callback(functools.partial(release, reserved))
+                tasks.append(task)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            if hasattr(pages, "close"):
+                try:
+                    pages.close()
+                except ValueError:
+                    # Still running in a worker thread; it is closed when collected
+                    pass
             raise
-        except Exception as e:
-            # Provide simple error messages
-            error_message = "PDF processing failed"
-            if "connect" in str(e).lower() or "connection" in str(e).lower():
-                error_message = "OCR service unavailable"
-            elif "timeout" in str(e).lower():
-                error_message = "Processing timeout"
-            elif "model" in str(e).lower():
-                error_message = "OCR model error"
-            raise HTTPException(status_code=500, detail=error_message)
+        
+        results = await asyncio.gather(*tasks)
+        return sorted(results, key=lambda result: result["page"])
+    
+    async def _schedule(self, call: Callable[[], Awaitable[Dict[str, Any]]],
+                        context: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a model call through the scheduler, accumulating queue wait in context"""
+        if self.scheduler is None:
+            return await call()
+        
+        enqueued = time.perf_counter()
+        
+        async def timed_call() -> Dict[str, Any]:
+            context["queue"] += time.perf_counter() - enqueued
+            return await call()
+        
+        return await self.scheduler.run(context["client_id"], context["priority"], timed_call)
+    
+    async def _ocr_image(self, image_data: bytes, size: Optional[Tuple[int, int]], density: Optional[float],
+                         name: str, context: Dict[str, Any], depth: int = 0,
+                         min_tokens: int = 0) -> Dict[str, Any]:
+        """OCR an image with a size-aware budget, halving it if the output is truncated
+        
+        Each half gets at least the budget of the truncated image, so the
+        retry has more room in total rather than the same room split in two.
+        """
+        budget = self.token_budget.for_image(size, density, min_tokens)
+        result = await self._schedule(
+            lambda: self.lm_studio_client.process_image_ocr(image_data, name, **budget),
+            context
+        )
+        if not result.get("truncated") or depth >= self.file_processor.config.OCR_MAX_SPLIT_DEPTH:
+            return result
+        
+        parts = await asyncio.to_thread(self.file_processor.split_image, image_data)
+        if not parts:
+            return result
+        
+        results = await asyncio.gather(*(
+            self._ocr_image(part["data"], part["size"], part["density"], f"{name}_part{index + 1}",
+                            context, depth + 1, budget["max_tokens"])
+            for index, part in enumerate(parts)
+        ))
+        # The halves overlap, so lines on the cut may have been read twice
+        return self._merge_parts(results, overlapping=True)
+    
+    async def _ocr_text(self, text: str, context: Dict[str, Any], depth: int = 0,
+                        min_tokens: int = 0) -> Dict[str, Any]:
+        """Clean up text with a length-aware budget, halving it if the output is truncated"""
+        budget = self.token_budget.for_text(len(text), min_tokens)
+        result = await self._schedule(
+            lambda: self.lm_studio_client.process_text_ocr(text, **budget),
+            context
+        )
+        if not result.get("truncated") or depth >= self.file_processor.config.OCR_MAX_SPLIT_DEPTH:
+            return result
+        
+        # Split on the line break closest to the middle
+        middle = len(text) // 2
+        cut = text.rfind("\n", 0, middle)
+        if cut <= 0:
+            cut = text.find("\n", middle)
+        if cut <= 0:
+            return result
+        
+        results = await asyncio.gather(
+            self._ocr_text(text[:cut], context, depth + 1, budget["max_tokens"]),
+            self._ocr_text(text[cut + 1:], context, depth + 1, budget["max_tokens"])
+        )
+        return self._merge_parts(results)
+    
+    @staticmethod
+    def _merge_parts(results: List[Dict[str, Any]], overlapping: bool = False) -> Dict[str, Any]:
+        """Combine the results of the parts of a split page
+        
+        With ``overlapping`` parts, lines at the start of a part that repeat
+        the end of the previous part are dropped.
+        """
+        lines: List[str] = []
+        for result in results:
+            part_lines = result["text"].splitlines() if result["text"] else []
+            if overlapping:
+                part_lines = part_lines[OCRService._overlap_length(lines, part_lines):]
+            lines.extend(part_lines)
+        
+        return {
+            "text": "\n".join(lines),
+            "confidence": min(result["confidence"] for result in results),
+            "model_used": next((result["model_used"] for result in results
+                                if result.get("model_used") == "fallback"), results[0].get("model_used")),
+            "truncated": any(result.get("truncated") for result in results)
+        }
+    
+    @staticmethod
+    def _overlap_length(previous: List[str], following: List[str]) -> int:
+        """Number of leading lines of following that repeat the last lines of previous"""
+        def normalize(line: str) -> str:
+            return " ".join(line.split())
+        
+        # The overlap band of split_image() is a few lines of text at most
+        for length in range(min(len(previous), len(following), 10), 0, -1):
+            if all(normalize(a) == normalize(b) for a, b in zip(previous[-length:], following[:length])):
+                # Blank lines alone are not evidence of an overlap
+                if any(normalize(line) for line in following[:length]):
+                    return length
+        return 0
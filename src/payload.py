@@ -0,0 +1,75 @@
+"""Request body construction for LM Studio vision calls"""
+import binascii
+import json
+from typing import Dict, Iterator, Tuple
+
+# Bytes of raw image per base64 chunk (a multiple of 3, so chunks concatenate
+# into one valid base64 string without padding in between)
+CHUNK_SIZE = 3 * 64 * 1024
+
+_IMAGE_PLACEHOLDER = "__IMAGE_BASE64__"
+_MAX_TOKENS_PLACEHOLDER = "__MAX_TOKENS__"
+
+
+class VisionPayloadBuilder:
+    """Builds chat-completion bodies for image OCR without full-size copies
+
+    The JSON around the image never changes for a given model, prompt and
+    MIME type, so it is rendered once and cached as bytes, split at the
+    ``max_tokens`` value (which differs per call) and at the image. The image is base64-encoded chunk by chunk while the
+    body is being sent, which keeps peak memory per page close to the size of
+    the encoded image instead of several copies of its base64 text.
+    """
+
+    def __init__(self, model_name: str, prompt: str, temperature: float = 0.1):
+        self.model_name = model_name
+        self.prompt = prompt
+        self.temperature = temperature
+        self._frames: Dict[str, Tuple[bytes, bytes, bytes]] = {}
+
+    def _frame(self, mime_type: str) -> Tuple[bytes, bytes, bytes]:
+        """Return the cached JSON before max_tokens, before the base64 data, and after it"""
+        frame = self._frames.get(mime_type)
+        if frame is None:
+            payload = {
+                "model": self.model_name,
+                "temperature": self.temperature,
+                "max_tokens": _MAX_TOKENS_PLACEHOLDER,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": self.prompt
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{mime_type};base64,{_IMAGE_PLACEHOLDER}"
+                                }
+                            }
+                        ]
+                    }
+                ]
+            }
+            head, rest = json.dumps(payload).split(f'"{_MAX_TOKENS_PLACEHOLDER}"')
+            middle, suffix = rest.split(_IMAGE_PLACEHOLDER)
+            frame = self._frames[mime_type] = tuple(part.encode("utf-8") for part in (head, middle, suffix))
+        return frame
+
+    def build(self, image_data: bytes, max_tokens: int,
+              mime_type: str = "image/jpeg") -> Tuple[int, Iterator[bytes]]:
+        """Return the body length and a lazy iterator over its chunks"""
+        head, middle, suffix = self._frame(mime_type)
+        prefix = b"%s%d%s" % (head, max_tokens, middle)
+        encoded_length = 4 * ((len(image_data) + 2) // 3)
+        return len(prefix) + encoded_length + len(suffix), self._chunks(prefix, image_data, suffix)
+
+    @staticmethod
+    def _chunks(prefix: bytes, image_data: bytes, suffix: bytes) -> Iterator[bytes]:
+        yield prefix
+        view = memoryview(image_data)
+        for offset in range(0, len(view), CHUNK_SIZE):
+            yield binascii.b2a_base64(view[offset:offset + CHUNK_SIZE], newline=False)
+        yield suffix
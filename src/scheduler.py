@@ -0,0 +1,165 @@
+"""Fair scheduling of model calls between priority classes and clients"""
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class OCRScheduler:
+    """Hierarchical fair queue in front of LMStudioClient
+
+    Every model call (one page) is a job of a client in a priority class.
+    Scheduling has two levels. Classes share the model by weighted fair
+    queuing: the next job of each class with queued jobs has a virtual
+    finish tag ``1 / weight`` after the later of the virtual clock (when the
+    class becomes backlogged) and the class's previous finish tag, and the
+    class with the smallest tag goes next. The virtual clock follows the
+    start tag of the job last dispatched. A class with weight 4 therefore gets four times
+    the share of a class with weight 1, however many clients each class has.
+    Within the chosen class, the waiting client that was served least
+    recently goes next, so clients get equal shares of their class and opening more client IDs does not take
+    more of another class's share. Because jobs are pages rather than
+    documents, a single receipt slots in between the pages of a 50-page bulk
+    upload instead of waiting for it to finish.
+
+    The scheduler orders calls within one worker process; with several
+    workers, each should get its share of the model slots (see
+    ``Config.SCHEDULER_CONCURRENCY``) so that it is the scheduler, and not
+    the shared limiter, that decides which call runs next.
+    """
+
+    def __init__(self, concurrency: int, weights: Dict[str, float]):
+        self.concurrency = concurrency
+        self.weights = weights
+        self._active = 0
+        self._virtual_time = 0.0
+        # Finish tag of each class's last dispatched job, and of its next queued one
+        self._class_finish: Dict[str, float] = {priority: 0.0 for priority in weights}
+        self._head_finish: Dict[str, float] = {priority: 0.0 for priority in weights}
+        # Per class, waiting jobs per client (in arrival order), and when each
+        # client of the class was last dispatched
+        self._queues: Dict[str, Dict[str, Deque[asyncio.Future]]] = {priority: {} for priority in weights}
+        self._last_served: Dict[str, Dict[str, int]] = {priority: {} for priority in weights}
+        self._sequence = itertools.count()
+        self._stats = {
+            priority: {"queued": 0, "dispatched": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for priority in weights
+        }
+
+    async def run(self, client_id: str, priority: str, call: Callable[[], Awaitable[T]]) -> T:
+        """Wait for this client's turn in its class, then run ``call`` while holding a slot"""
+        if priority not in self.weights:
+            priority = INTERACTIVE
+
+        enqueued = time.perf_counter()
+
+        if self._active < self.concurrency and not any(self._queues.values()):
+            self._active += 1
+            self._advance(priority, client_id, self._start_tag(priority) + 1.0 / self.weights[priority])
+        else:
+            future = asyncio.get_running_loop().create_future()
+            if not self._queues[priority]:
+                # The class becomes backlogged: tag its head job from now on
+                self._head_finish[priority] = self._start_tag(priority) + 1.0 / self.weights[priority]
+            self._queues[priority].setdefault(client_id, deque()).append(future)
+            self._stats[priority]["queued"] += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as we were cancelled
+                    self._release()
+                else:
+                    future.cancel()
+                    self._stats[priority]["queued"] -= 1
+                raise
+
+        self._record_dispatch(priority, time.perf_counter() - enqueued)
+        try:
+            return await call()
+        finally:
+            self._release()
+
+    def _start_tag(self, priority: str) -> float:
+        # A class that was idle does not bank credit for the time it was idle
+        return max(self._virtual_time, self._class_finish[priority])
+
+    def _advance(self, priority: str, client_id: str, finish: float) -> None:
+        """Charge one job to the class and client, and move the virtual clock to its start"""
+        self._class_finish[priority] = finish
+        self._virtual_time = finish - 1.0 / self.weights[priority]
+        self._last_served[priority][client_id] = next(self._sequence)
+
+    def _pop_job(self, priority: str) -> Optional[Tuple[str, asyncio.Future]]:
+        """Take the next waiting job of the class from its least recently served client"""
+        clients = self._queues[priority]
+        last_served = self._last_served[priority]
+        while clients:
+            client_id = min(clients, key=lambda client: last_served.get(client, -1))
+            jobs = clients[client_id]
+            future = jobs.popleft()
+            if not jobs:
+                del clients[client_id]
+            if not future.cancelled():
+                return client_id, future
+        return None
+
+    def _record_dispatch(self, priority: str, wait: float) -> None:
+        stats = self._stats[priority]
+        stats["dispatched"] += 1
+        stats["total_wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+
+    def _release(self) -> None:
+        """Hand the freed slot to the next job of the class with the smallest finish tag"""
+        while True:
+            waiting = [priority for priority, clients in self._queues.items() if clients]
+            if not waiting:
+                self._active -= 1
+                # Idle clients only need their turn order while others wait
+                for priority, last_served in self._last_served.items():
+                    if len(last_served) > 1024:
+                        self._last_served[priority] = {
+                            client: served for client, served in last_served.items()
+                            if client in self._queues[priority]
+                        }
+                return
+
+            priority = min(waiting, key=lambda priority: self._head_finish[priority])
+            job = self._pop_job(priority)
+            if job is None:
+                # Only cancelled jobs were left in this class
+                continue
+
+            client_id, future = job
+            self._stats[priority]["queued"] -= 1
+            self._advance(priority, client_id, self._head_finish[priority])
+            # The class's next job starts where this one finishes
+            self._head_finish[priority] += 1.0 / self.weights[priority]
+            future.set_result(None)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-class queue depth and wait times"""
+        classes = {}
+        for priority, stats in self._stats.items():
+            dispatched = stats["dispatched"]
+            classes[priority] = {
+                "weight": self.weights[priority],
+                "queue_depth": stats["queued"],
+                "clients_waiting": len(self._queues[priority]),
+                "dispatched": dispatched,
+                "avg_wait_seconds": round(stats["total_wait"] / dispatched, 3) if dispatched else 0.0,
+                "max_wait_seconds": round(stats["max_wait"], 3)
+            }
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "classes": classes
+        }
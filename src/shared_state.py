@@ -0,0 +1,150 @@
+"""Shared state for multi-worker deployments, backed by the local filesystem"""
+import asyncio
+import errno
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+
+class SharedCache:
+    """OCR result cache shared by all workers through a local SQLite file"""
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def open(self) -> None:
+        """Open the cache database (call once per worker, after fork)"""
+        if not self.enabled or self._conn is not None:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn = conn
+
+    def close(self) -> None:
+        """Close the cache database"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result, or None if missing or expired"""
+        if self._conn is None:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a result for the configured TTL"""
+        if self._conn is None:
+            return
+
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            self._conn.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """Async wrapper around get() that keeps SQLite off the event loop"""
+        if self._conn is None:
+            return None
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        """Async wrapper around set() that keeps SQLite off the event loop"""
+        if self._conn is None:
+            return
+        await asyncio.to_thread(self.set, key, value)
+
+
+class SharedLimiter:
+    """Concurrency limiter shared by all workers through per-slot lock files"""
+
+    def __init__(self, directory: str, name: str, slots: int, poll_interval: float = 0.05):
+        self.directory = directory
+        self.name = name
+        self.slots = slots
+        self.poll_interval = poll_interval
+        # Time this process spent waiting for slots held by other callers
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _slot_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"{self.name}.{index}.lock")
+
+    def try_acquire(self) -> Optional[int]:
+        """Try to take a free slot; return its file descriptor or None"""
+        os.makedirs(self.directory, exist_ok=True)
+        for index in range(self.slots):
+            fd = os.open(self._slot_path(index), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError as e:
+                os.close(fd)
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+        return None
+
+    def release(self, fd: int) -> None:
+        """Release a slot taken with try_acquire()"""
+        # Closing the descriptor drops the flock
+        os.close(fd)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one slot for the duration of the block"""
+        started = time.perf_counter()
+        fd = self.try_acquire()
+        if fd is None:
+            self.waited += 1
+        while fd is None:
+            await asyncio.sleep(self.poll_interval)
+            fd = self.try_acquire()
+        wait = time.perf_counter() - started
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        try:
+            yield
+        finally:
+            self.release(fd)
+
+    def stats(self) -> Dict[str, Any]:
+        """Slot waits seen by this process"""
+        return {
+            "slots": self.slots,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "avg_wait_seconds": round(self.total_wait / self.acquired, 3) if self.acquired else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3)
+        }
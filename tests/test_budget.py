@@ -0,0 +1,68 @@
+"""Unit tests for per-call token budgets"""
+import pytest
+import sys
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.budget import TokenBudget
+from src.config import Config
+
+class TestTokenBudget:
+    """Test the TokenBudget class"""
+    
+    def test_small_crop_gets_minimum_budget(self):
+        """Test that a receipt-sized crop reserves the minimum decode budget"""
+        budget = TokenBudget(Config()).for_image((400, 600), density=0.1)
+        
+        assert budget["max_tokens"] == 256
+        assert budget["timeout"] < 20
+    
+    def test_dense_page_gets_larger_budget(self):
+        """Test that budgets grow with area and density, within the bounds"""
+        token_budget = TokenBudget(Config())
+        
+        sparse = token_budget.for_image((1224, 1584), density=0.01)
+        dense = token_budget.for_image((1224, 1584), density=0.2)
+        huge = token_budget.for_image((2048, 2048 * 4))
+        
+        assert sparse["max_tokens"] < dense["max_tokens"]
+        assert dense["max_tokens"] == int(1224 * 1584 / 1_000_000 * 1000)
+        assert huge["max_tokens"] == 4096
+        assert huge["timeout"] == pytest.approx(10 + 4.096 * 25)
+    
+    def test_rendered_dense_page_gets_full_budget(self):
+        """Test the density estimate on a real rendered page of small text"""
+        fitz = pytest.importorskip("fitz")
+        from PIL import Image
+        from src.file_processor import FileProcessor
+        
+        pdf_doc = fitz.open()
+        page = pdf_doc.new_page()
+        line = "The quick brown fox jumps over the lazy dog while the committee reviews figures. " * 2
+        for index in range(63):
+            page.insert_text((54, 54 + index * 11), (line[index % 7:] + line[:index % 7])[:119], fontsize=9)
+        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        
+        frame = FileProcessor(Config())._encode_frame(img)
+        budget = TokenBudget(Config()).for_image(frame["size"], frame["density"])
+        
+        # About 7,500 characters of text: roughly 1,900 output tokens
+        assert 0.05 < frame["density"] < 0.2
+        assert budget["max_tokens"] >= 1900
+    
+    def test_text_budget_scales_with_length(self):
+        """Test that text cleanup budgets follow the input length"""
+        token_budget = TokenBudget(Config())
+        
+        assert token_budget.for_text(100)["max_tokens"] == 256
+        assert token_budget.for_text(6000)["max_tokens"] == 2564
+    
+    def test_timeout_is_capped(self, monkeypatch):
+        """Test that timeouts never exceed the configured maximum"""
+        monkeypatch.setenv("OCR_MAX_TIMEOUT_SECONDS", "45")
+        token_budget = TokenBudget(Config())
+        
+        assert token_budget.for_image(None)["timeout"] == 45
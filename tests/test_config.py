@@ -24,6 +24,27 @@ class TestConfig:
         assert config.HOST == "0.0.0.0"
         assert config.PORT == 8000
         assert config.DEBUG == True
+        assert config.WORKERS == 1
+        assert config.RELOAD == True
+        assert config.RESULT_CACHE_TTL_SECONDS == 3600
+        assert config.LM_STUDIO_MAX_CONCURRENCY == 4
+        assert config.WARMUP_ON_STARTUP == False
+        assert config.MEMORY_BUDGET_BYTES == 1024 * 1024 * 1024
+    
+    @patch.dict(os.environ, {
+        'WORKERS': '4'
+    })
+    def test_multiple_workers_disable_reload(self):
+        """Test that reload watchers are off when running several workers"""
+        config = Config()
+        
+        assert config.WORKERS == 4
+        # Each worker dispatches its share of the model slots
+        assert config.SCHEDULER_CONCURRENCY == 1
+        # ... and its share of the memory budget
+        assert config.MEMORY_BUDGET_BYTES == 256 * 1024 * 1024
+        assert config.DEBUG == True
+        assert config.RELOAD == False
     
     @patch.dict(os.environ, {
         'LM_STUDIO_BASE_URL': 'http://localhost:8080',
@@ -101,6 +122,19 @@ class TestConfig:
         assert config.get_file_type("file.txt") == "unsupported"
         assert config.get_file_type("") == "unsupported"
     
+    def test_format_file_type_detection(self):
+        """Test categorization of formats detected from file content"""
+        config = Config()
+        
+        assert isinstance(config.SUPPORTED_IMAGE_FORMATS, frozenset)
+        assert config.SUPPORTED_IMAGE_KINDS == {"jpeg", "png", "bmp", "tiff", "webp"}
+        assert config.get_format_file_type("jpeg") == "image"
+        assert config.get_format_file_type("tiff") == "image"
+        assert config.get_format_file_type("pdf") == "pdf"
+        assert config.get_format_file_type("gif") == "unsupported"
+        assert config.get_extension("archive.tar.GZ") == "gz"
+        assert config.get_extension("README") == ""
+    
     @patch.dict(os.environ, {
         'SUPPORTED_IMAGE_FORMATS': 'jpg,png'
     })
@@ -113,5 +147,16 @@ class TestConfig:
         assert config.is_supported_image_format("test.bmp") == False
         assert config.is_supported_image_format("test.tiff") == False
 
+    @patch.dict(os.environ, {
+        'SUPPORTED_IMAGE_FORMATS': 'jpg,png,jp2,ico'
+    })
+    def test_undetectable_image_formats_are_ignored(self):
+        """Test that formats content sniffing cannot identify are dropped"""
+        config = Config()
+        
+        assert config.SUPPORTED_IMAGE_FORMATS == frozenset({"jpg", "png"})
+        assert config.is_supported_image_format("icon.ico") == False
+        assert config.get_format_file_type("jp2") == "unsupported"
+
 if __name__ == "__main__":
     pytest.main([__file__])
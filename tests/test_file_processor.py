@@ -0,0 +1,200 @@
+"""Unit tests for file processing"""
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.config import Config, DETECTABLE_IMAGE_FORMATS
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("fastapi")
+
+from src.file_processor import FileProcessor, PIL_FORMATS
+
+def make_tiff(frame_count, size=(320, 240)):
+    """Build a multi-page TIFF in memory"""
+    frames = [Image.new('L', size, color=255 - index) for index in range(frame_count)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='TIFF', save_all=True, append_images=frames[1:])
+    return buffer.getvalue()
+
+class TestFormatDetection:
+    """Test content sniffing in FileProcessor"""
+    
+    def test_sniff_known_formats(self):
+        """Test that magic bytes identify each supported format"""
+        for pil_format, expected in (('JPEG', 'jpeg'), ('PNG', 'png'), ('BMP', 'bmp'),
+                                     ('TIFF', 'tiff'), ('WEBP', 'webp'), ('GIF', 'gif')):
+            buffer = io.BytesIO()
+            Image.new('RGB', (8, 8)).save(buffer, format=pil_format)
+            assert FileProcessor.sniff_format(buffer.getvalue()) == expected
+        
+        assert FileProcessor.sniff_format(b"%PDF-1.7\n") == "pdf"
+        assert FileProcessor.sniff_format(b"plain text") is None
+    
+    def test_detectable_formats_are_sniffed(self):
+        """Test that every format Config accepts as detectable is recognized"""
+        for detected_format in DETECTABLE_IMAGE_FORMATS:
+            buffer = io.BytesIO()
+            Image.new('RGB', (8, 8)).save(buffer, format=PIL_FORMATS[detected_format])
+            assert FileProcessor.sniff_format(buffer.getvalue()) == detected_format
+    
+    def test_content_decides_regardless_of_extension(self):
+        """Test that the extension neither admits nor rejects an upload"""
+        from fastapi import UploadFile
+        
+        processor = FileProcessor(Config())
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+        
+        for filename in ("scan", "scan.txt"):
+            asyncio.run(processor.validate_file(UploadFile(file=io.BytesIO(), filename=filename)))
+        assert processor.detect_format(buffer.getvalue()) == "png"
+    
+    def test_mislabeled_file_is_rejected(self):
+        """Test that content which is not a supported format fails before decoding"""
+        from fastapi import HTTPException
+        
+        processor = FileProcessor(Config())
+        
+        with pytest.raises(HTTPException) as exc_info:
+            processor.detect_format(b"This is just plain text named receipt.jpg")
+        assert exc_info.value.status_code == 400
+        
+        # GIF is a real image, but not in the default supported formats
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, format='GIF')
+        with pytest.raises(HTTPException):
+            processor.detect_format(buffer.getvalue())
+
+class TestImageFrames:
+    """Test frame handling in FileProcessor.process_image"""
+    
+    def test_multi_frame_tiff_yields_every_frame(self):
+        """Test that every TIFF page is returned as its own JPEG frame"""
+        processor = FileProcessor(Config())
+        
+        image_data = asyncio.run(processor.process_image(make_tiff(3)))
+        frames = list(image_data["frames"])
+        
+        assert image_data["frame_count"] == 3
+        assert [frame["page"] for frame in frames] == [1, 2, 3]
+        for frame in frames:
+            assert frame["data"][:2] == b"\xff\xd8"
+            assert frame["size"] == (320, 240)
+    
+    def test_single_frame_image(self):
+        """Test that ordinary images produce a single downscaled frame"""
+        processor = FileProcessor(Config())
+        buffer = io.BytesIO()
+        Image.new('RGBA', (4096, 1024)).save(buffer, format='PNG')
+        
+        image_data = asyncio.run(processor.process_image(buffer.getvalue()))
+        frames = list(image_data["frames"])
+        
+        assert image_data["frame_count"] == 1
+        assert len(frames) == 1
+        assert frames[0]["size"] == (2048, 512)
+        assert frames[0]["mode"] == "RGB"
+    
+    def test_frame_limit(self, monkeypatch):
+        """Test that images with too many frames are rejected before decoding"""
+        from fastapi import HTTPException
+        
+        monkeypatch.setenv("SUPPORTED_IMAGE_MAX_FRAMES", "2")
+        processor = FileProcessor(Config())
+        
+        with pytest.raises(HTTPException) as exc_info:
+            asyncio.run(processor.process_image(make_tiff(3)))
+        assert exc_info.value.status_code == 400
+
+class TestPdfPages:
+    """Test per-page routing in FileProcessor.process_pdf"""
+    
+    def test_mixed_pdf_pages_in_order(self):
+        """Test that text and scanned pages are classified per page, in order"""
+        fitz = pytest.importorskip("fitz")
+        processor = FileProcessor(Config())
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (200, 100), color='white').save(buffer, format='PNG')
+        pdf_doc = fitz.open()
+        pdf_doc.new_page().insert_text((72, 72), "First page")
+        scanned = pdf_doc.new_page()
+        scanned.insert_image(scanned.rect, stream=buffer.getvalue())
+        pdf_doc.new_page().insert_text((72, 72), "Third page")
+        
+        pdf_data = asyncio.run(processor.process_pdf(pdf_doc.tobytes()))
+        pages = list(pdf_data["pages"])
+        
+        assert pdf_data["page_count"] == 3
+        assert [(page["page"], page["source"]) for page in pages] == [(1, "text"), (2, "ocr"), (3, "text")]
+        assert pages[0]["text"] == "First page"
+        assert pages[1]["data"][:2] == b"\xff\xd8"
+
+def make_scanned_pdf(image_bytes, rotation=0, redaction=False, scale=1, crop=False):
+    """Build a one-page PDF whose page is a single full-page image"""
+    fitz = pytest.importorskip("fitz")
+    pdf_doc = fitz.open()
+    page = pdf_doc.new_page(width=612, height=792)
+    page.insert_image(fitz.Rect(0, 0, 612 * scale, 792 * scale), stream=image_bytes, keep_proportion=False)
+    if crop:
+        # Only the top-left quarter of the scan is visible
+        page.set_cropbox(fitz.Rect(0, 0, 306, 396))
+    if redaction:
+        # A filled box drawn over the scan, hiding what is underneath
+        page.draw_rect(fitz.Rect(100, 100, 300, 130), color=(0, 0, 0), fill=(0, 0, 0))
+    page.set_rotation(rotation)
+    return pdf_doc.tobytes()
+
+def encode(size, pil_format):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 32).convert('RGB').save(buffer, format=pil_format)
+    return buffer.getvalue()
+
+class TestPdfEmbeddedImages:
+    """Test the single embedded JPEG fast path for scanned PDF pages"""
+    
+    def test_embedded_jpeg_is_passed_through(self):
+        """Test that a full-page JPEG is sent without re-encoding"""
+        processor = FileProcessor(Config())
+        jpeg = encode((850, 1100), 'JPEG')
+        
+        pdf_data = asyncio.run(processor.process_pdf(make_scanned_pdf(jpeg)))
+        page = next(pdf_data["pages"])
+        
+        assert page["data"] == jpeg
+        assert page["size"] == (850, 1100)
+        assert "extract_image" in page["timings"]
+    
+    def test_large_embedded_jpeg_is_downscaled(self):
+        """Test that an oversized embedded JPEG is downscaled to the size limit"""
+        processor = FileProcessor(Config())
+        
+        pdf_data = asyncio.run(processor.process_pdf(make_scanned_pdf(encode((2550, 3300), 'JPEG'))))
+        page = next(pdf_data["pages"])
+        
+        assert max(page["size"]) <= 2048
+        assert page["size"][0] < 2550
+        assert page["data"][:2] == b"\xff\xd8"
+        assert "extract_image" in page["timings"]
+    
+    def test_other_pages_are_rasterized(self):
+        """Test that pages the embedded JPEG would not show faithfully fall back to rendering"""
+        processor = FileProcessor(Config())
+        
+        for pdf_bytes in (make_scanned_pdf(encode((850, 1100), 'PNG')),
+                          make_scanned_pdf(encode((850, 1100), 'JPEG'), rotation=90),
+                          make_scanned_pdf(encode((850, 1100), 'JPEG'), redaction=True),
+                          make_scanned_pdf(encode((850, 1100), 'JPEG'), scale=2),
+                          make_scanned_pdf(encode((850, 1100), 'JPEG'), crop=True)):
+            pdf_data = asyncio.run(processor.process_pdf(pdf_bytes))
+            page = next(pdf_data["pages"])
+            
+            assert "render" in page["timings"]
+            assert page["data"][:2] == b"\xff\xd8"
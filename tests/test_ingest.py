@@ -0,0 +1,138 @@
+"""Unit tests for the offline bulk-ingestion CLI"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+Image = pytest.importorskip("PIL.Image")
+
+import ingest
+
+def write_png(path):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 32), 'white').save(buffer, format='PNG')
+    path.write_bytes(buffer.getvalue())
+
+class StubClient:
+    """Stands in for LMStudioClient; fails every call while ``down`` is set"""
+    
+    model_name = "stub-model"
+    down = False
+    
+    def __init__(self, config):
+        self.config = config
+    
+    async def startup(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def process_image_ocr(self, image_data, filename, max_tokens=2000, timeout=60.0):
+        if StubClient.down:
+            raise Exception("Cannot connect to host")
+        return {"text": "text", "confidence": 0.9, "model_used": self.model_name, "truncated": False}
+
+class TestCheckpoint:
+    """Test which results are skipped when a run is resumed"""
+    
+    def test_load_checkpoint(self, tmp_path):
+        """Test successes and permanent failures are done; transient failures are retried"""
+        output = tmp_path / "results.jsonl"
+        records = [
+            {"path": "/ok.png", "success": True, "pages": [{"page": 1, "text": "x"}]},
+            {"path": "/bad.jpg", "success": False, "error": "unsupported", "permanent": True},
+            {"path": "/down.png", "success": False, "error": "OCR service unavailable", "permanent": False},
+            {"path": "/model-error.png", "success": False, "error": "OCR model error"},
+            {"path": "/partial.pdf", "success": True, "pages": [{"page": 1}, {"page": 2, "error": "x"}]},
+            {"path": "/raw.pdf", "success": True, "pages": [{"page": 1, "fallback": True}]},
+        ]
+        lines = [json.dumps(record) for record in records]
+        # An interrupted run can leave a partial last line
+        output.write_text("\n".join(lines) + '\n{"path": "/cut.png", "succ')
+        
+        assert ingest.load_checkpoint(output) == {"/ok.png", "/bad.jpg"}
+    
+    def test_missing_output_is_empty_checkpoint(self, tmp_path):
+        """Test that a first run starts from nothing"""
+        assert ingest.load_checkpoint(tmp_path / "missing.jsonl") == set()
+
+class TestDiscoverFiles:
+    """Test input discovery from directories and manifests"""
+    
+    def test_directory_walk(self, tmp_path):
+        """Test that directories are walked in sorted order, whatever the extensions"""
+        (tmp_path / "b").mkdir()
+        names = ("a.tif", "c.gif", "notes.txt", "b/1.jpg", "b/2.PDF", "b/scan")
+        for name in names:
+            (tmp_path / name).write_bytes(b"")
+        
+        paths = list(ingest.discover_files(tmp_path))
+        
+        assert paths == [str(tmp_path / name) for name in names]
+    
+    def test_manifest(self, tmp_path, monkeypatch):
+        """Test that manifests skip blanks and comments and resolve relative paths"""
+        manifest = tmp_path / "manifest.txt"
+        manifest.write_text("# scans\n\nscans/a.png\n  /data/b.pdf  \n# done\n")
+        monkeypatch.chdir(tmp_path)
+        
+        paths = list(ingest.discover_files(manifest))
+        
+        assert paths == [str(tmp_path / "scans" / "a.png"), "/data/b.pdf"]
+
+class TestPrepareFile:
+    """Test preprocessing errors in the pool worker"""
+    
+    def test_errors_are_classified(self, tmp_path):
+        """Test that unsupported content is permanent and unreadable files are not"""
+        ingest._init_worker()
+        bad = tmp_path / "bad.jpg"
+        bad.write_bytes(b"not an image")
+        
+        assert ingest.prepare_file(str(bad))["permanent"] is True
+        assert ingest.prepare_file(str(tmp_path / "missing.png"))["permanent"] is False
+
+class TestResume:
+    """Test re-running an interrupted or partly failed job"""
+    
+    def run(self, tmp_path):
+        args = argparse.Namespace(source=str(tmp_path / "in"), output=str(tmp_path / "out.jsonl"),
+                                  workers=1, concurrency=2, progress_interval=60.0)
+        asyncio.run(ingest.ingest(args))
+        with open(args.output) as f:
+            return [json.loads(line) for line in f]
+    
+    def test_resume_retries_only_transient_failures(self, tmp_path, monkeypatch):
+        """Test that a second run redoes transient failures and nothing else"""
+        monkeypatch.setattr(ingest, "LMStudioClient", StubClient)
+        source = tmp_path / "in"
+        source.mkdir()
+        write_png(source / "good.png")
+        (source / "bad.jpg").write_bytes(b"This is not an image")
+        # A fax TIFF named .tif is taken by content, not skipped for its extension
+        buffer = io.BytesIO()
+        Image.new('L', (64, 32), 255).save(buffer, format='TIFF')
+        (source / "fax.tif").write_bytes(buffer.getvalue())
+        
+        StubClient.down = True
+        first = self.run(tmp_path)
+        StubClient.down = False
+        second = self.run(tmp_path)
+        third = self.run(tmp_path)
+        
+        assert {(os.path.basename(r["path"]), r["success"]) for r in first} == {
+            ("good.png", False), ("bad.jpg", False), ("fax.tif", False)
+        }
+        assert {(os.path.basename(r["path"]), r["success"]) for r in second[3:]} == {
+            ("good.png", True), ("fax.tif", True)
+        }
+        assert third == second
@@ -0,0 +1,50 @@
+"""Unit tests for the API endpoints"""
+import asyncio
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+import main
+
+class TestReadiness:
+    """Test the liveness and readiness probes"""
+    
+    def test_ready_after_startup(self):
+        """Test that a worker without warm-up is ready once started"""
+        with TestClient(main.app) as client:
+            assert client.get("/health/live").status_code == 200
+            response = client.get("/health/ready")
+        
+        assert response.status_code == 200
+        assert response.json() == {"status": "ready", "warmup": "skipped"}
+    
+    def test_failed_warmup_is_not_ready(self):
+        """Test that a failed warm-up keeps the worker out of rotation"""
+        with TestClient(main.app) as client:
+            with patch.dict(main.readiness, {"ready": False, "warmup": "failed"}):
+                response = client.get("/health/ready")
+        
+        assert response.status_code == 503
+        assert response.json()["warmup"] == "failed"
+    
+    def test_warmup_is_retried(self):
+        """Test that warm-up retries after a failure and then marks the worker ready"""
+        seen = []
+        
+        async def flaky_warm_up():
+            seen.append(dict(main.readiness))
+            if len(seen) < 3:
+                raise Exception("Cannot connect to host")
+        
+        with patch.object(main.ocr_service, "warm_up", flaky_warm_up), \
+                patch.dict(main.readiness, {"ready": False, "warmup": "running"}):
+            asyncio.run(main.warm_up(initial_delay=0))
+            final = dict(main.readiness)
+        
+        assert seen[1] == {"ready": False, "warmup": "failed"}
+        assert final == {"ready": True, "warmup": "completed"}
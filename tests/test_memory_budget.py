@@ -0,0 +1,99 @@
+"""Unit tests for the memory budget governor"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+from src.memory_budget import MemoryBudget
+
+class TestMemoryBudget:
+    """Test the MemoryBudget class"""
+    
+    def test_reservations_wait_for_room(self):
+        """Test that a reservation waits until enough bytes are released"""
+        budget = MemoryBudget(100, wait_seconds=1)
+        order = []
+        
+        async def holder():
+            async with budget.reserve(80):
+                order.append("holder")
+                await asyncio.sleep(0.01)
+            order.append("released")
+        
+        async def waiter():
+            await asyncio.sleep(0)
+            async with budget.reserve(50):
+                order.append("waiter")
+                assert budget.used == 50
+        
+        async def main():
+            await asyncio.gather(holder(), waiter())
+        
+        asyncio.run(main())
+        assert order == ["holder", "released", "waiter"]
+        assert budget.used == 0
+        assert budget.stats()["peak_bytes"] == 80
+    
+    def test_exhausted_budget_rejects(self):
+        """Test that a request is rejected with 503 when no room frees up in time"""
+        budget = MemoryBudget(100, wait_seconds=0.01)
+        
+        async def main():
+            held = await budget.acquire(100)
+            with pytest.raises(HTTPException) as exc_info:
+                await budget.acquire(10)
+            budget.release(held)
+            return exc_info.value.status_code
+        
+        assert asyncio.run(main()) == 503
+        assert budget.stats()["rejected"] == 1
+        assert budget.stats()["waiting"] == 0
+        assert budget.used == 0
+    
+    def test_oversized_reservation_is_clamped(self):
+        """Test that a request larger than the budget can still run alone"""
+        budget = MemoryBudget(100, wait_seconds=0.01)
+        
+        async def main():
+            async with budget.reserve(1000):
+                assert budget.used == 100
+        
+        asyncio.run(main())
+        assert budget.used == 0
+    
+    def test_try_acquire_never_queues(self):
+        """Test that try_acquire takes room only when it is free and nobody is waiting"""
+        budget = MemoryBudget(100, wait_seconds=1)
+        
+        async def main():
+            held = budget.try_acquire(60)
+            assert held == 60
+            assert budget.try_acquire(60) is None
+            
+            waiter = asyncio.create_task(budget.acquire(50))
+            await asyncio.sleep(0)
+            # 40 bytes are free, but a queued reservation comes first
+            assert budget.try_acquire(30) is None
+            
+            budget.release(held)
+            budget.release(await waiter)
+        
+        asyncio.run(main())
+        assert budget.used == 0
+    
+    def test_disabled_budget(self):
+        """Test that a zero budget never blocks"""
+        budget = MemoryBudget(0, wait_seconds=0)
+        
+        async def main():
+            assert await budget.acquire(10 ** 12) == 0
+        
+        asyncio.run(main())
+        assert budget.enabled == False
@@ -0,0 +1,400 @@
+"""Unit tests for the OCR service, using a stub LM Studio client"""
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import UploadFile
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.file_processor import FileProcessor
+from src.memory_budget import MemoryBudget
+from src.ocr_service import OCRService, simple_error_message
+from src.shared_state import SharedCache
+
+class StubClient:
+    """Stands in for LMStudioClient; records calls and returns canned results"""
+    
+    model_name = "stub-model"
+    
+    def __init__(self, fail_text=(), fallback_text=()):
+        self.fail_text = fail_text
+        self.fallback_text = fallback_text
+        self.calls = []
+    
+    async def process_image_ocr(self, image_data, filename, max_tokens=2000, timeout=60.0):
+        self.calls.append(("image", filename, max_tokens))
+        await asyncio.sleep(0)
+        return {"text": f"ocr {filename}", "confidence": 0.9, "model_used": self.model_name,
+                "truncated": False}
+    
+    async def process_text_ocr(self, text, max_tokens=2000, timeout=30.0):
+        self.calls.append(("text", text, max_tokens))
+        await asyncio.sleep(0)
+        if any(marker in text for marker in self.fail_text):
+            raise Exception("Cannot connect to host localhost:1 ssl:default")
+        if any(marker in text for marker in self.fallback_text):
+            return {"text": text, "confidence": 0.8, "model_used": "fallback"}
+        return {"text": text.upper(), "confidence": 0.95, "model_used": self.model_name,
+                "truncated": False}
+
+def make_pdf(pages):
+    """Build a PDF with one page per item: a string is a text page, None a blank (scanned) page"""
+    fitz = pytest.importorskip("fitz")
+    pdf_doc = fitz.open()
+    for text in pages:
+        page = pdf_doc.new_page()
+        if text is not None:
+            page.insert_text((72, 72), text)
+    return pdf_doc.tobytes()
+
+def upload(content, filename="document.pdf"):
+    return UploadFile(file=io.BytesIO(content), filename=filename, size=len(content))
+
+class TestResultCache:
+    """Test which results are stored in the shared cache"""
+    
+    def make_service(self, tmp_path, client):
+        cache = SharedCache(str(tmp_path / "results.sqlite3"), 60)
+        cache.open()
+        return OCRService(client, FileProcessor(Config()), cache), cache
+    
+    def test_complete_result_is_cached(self, tmp_path):
+        """Test that a result without degraded pages is served from the cache"""
+        client = StubClient()
+        service, cache = self.make_service(tmp_path, client)
+        content = make_pdf(["first page", "second page"])
+        
+        first = asyncio.run(service.process_file(upload(content)))
+        second = asyncio.run(service.process_file(upload(content)))
+        cache.close()
+        
+        assert second == first
+        assert len(client.calls) == 2
+    
+    def test_degraded_results_are_not_cached(self, tmp_path):
+        """Test that failed and fallback pages are recomputed on the next upload"""
+        for client in (StubClient(fail_text=("second",)), StubClient(fallback_text=("second",))):
+            service, cache = self.make_service(tmp_path, client)
+            content = make_pdf(["first page", "second page"])
+            
+            asyncio.run(service.process_file(upload(content)))
+            asyncio.run(service.process_file(upload(content)))
+            cache.close()
+            
+            assert len(client.calls) == 4
+
+class TestPageErrors:
+    """Test how per-page failures are reported"""
+    
+    def test_page_error_is_mapped_to_simple_message(self):
+        """Test that raw exception text does not reach the page result"""
+        service = OCRService(StubClient(fail_text=("second",)), FileProcessor(Config()))
+        
+        result = asyncio.run(service.process_file(upload(make_pdf(["first page", "second page"]))))
+        failed = result["pages"][1]
+        
+        assert failed["error"] == "OCR service unavailable"
+        assert "localhost" not in str(result)
+        assert result["pdf_info"]["failed_pages"] == 1
+    
+    def test_simple_error_message(self):
+        """Test the mapping of exceptions to client-facing messages"""
+        assert simple_error_message(Exception("Connection refused"), "failed") == "OCR service unavailable"
+        assert simple_error_message(Exception("Read timeout"), "failed") == "Processing timeout"
+        assert simple_error_message(Exception("HTTP 500 - internal details"), "failed") == "failed"
+        # Mapped messages map to themselves
+        for message in ("OCR service unavailable", "Processing timeout", "OCR model error"):
+            assert simple_error_message(Exception(message), "failed") == message
+
+class PageClient:
+    """Stub client with per-page delays and failures that tracks concurrency"""
+    
+    model_name = "stub-model"
+    
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = failing
+        self.active = 0
+        self.peak = 0
+        self.kinds = {}
+        self.finished = []
+    
+    async def _call(self, kind, key):
+        self.kinds[key] = kind
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(key, 0.001))
+            if key in self.failing:
+                raise Exception("LM Studio API error: HTTP 500 - upstream details")
+        finally:
+            self.active -= 1
+        self.finished.append(key)
+        return {"text": f"{kind} {key}", "confidence": 0.9, "model_used": self.model_name,
+                "truncated": False}
+    
+    async def process_image_ocr(self, image_data, filename, max_tokens=2000, timeout=60.0):
+        return await self._call("image", image_data.decode())
+    
+    async def process_text_ocr(self, text, max_tokens=2000, timeout=30.0):
+        return await self._call("text", text)
+
+def make_pages(sources):
+    """Page dicts as yielded by FileProcessor, keyed "p<n>" for the stub client"""
+    pages = []
+    for number, source in enumerate(sources, start=1):
+        if source == "text":
+            pages.append({"page": number, "source": "text", "text": f"p{number}"})
+        else:
+            pages.append({"page": number, "source": "ocr", "data": f"p{number}".encode(), "size": (100, 100)})
+    return pages
+
+class TestOcrPages:
+    """Test the concurrent page pipeline of OCRService"""
+    
+    def make_service(self, client, memory_budget=None):
+        return OCRService(client, FileProcessor(Config()), memory_budget=memory_budget)
+    
+    def test_results_come_back_in_page_order(self):
+        """Test that pages finishing out of order are returned in page order"""
+        client = PageClient(delays={"p1": 0.03, "p2": 0.02, "p3": 0.01, "p4": 0.0})
+        service = self.make_service(client)
+        
+        results = asyncio.run(service._ocr_pages(iter(make_pages(["ocr"] * 4)), "doc"))
+        
+        assert client.finished == ["p4", "p3", "p2", "p1"]
+        assert [result["page"] for result in results] == [1, 2, 3, 4]
+        assert [result["text"] for result in results] == ["image p1", "image p2", "image p3", "image p4"]
+    
+    def test_text_and_ocr_pages_are_routed_concurrently(self):
+        """Test that text pages go to cleanup and scanned pages to OCR, side by side"""
+        client = PageClient(delays={key: 0.01 for key in ("p1", "p2", "p3", "p4")})
+        service = self.make_service(client)
+        
+        results = asyncio.run(service._ocr_pages(iter(make_pages(["text", "ocr", "text", "ocr"])), "doc"))
+        
+        assert client.kinds == {"p1": "text", "p2": "image", "p3": "text", "p4": "image"}
+        assert [result["source"] for result in results] == ["text", "ocr", "text", "ocr"]
+        assert client.peak == 4
+    
+    def test_concurrency_is_bounded(self):
+        """Test that no more than OCR_PAGE_CONCURRENCY pages are in flight"""
+        client = PageClient()
+        service = self.make_service(client)
+        
+        results = asyncio.run(service._ocr_pages(iter(make_pages(["ocr"] * 12)), "doc"))
+        
+        assert len(results) == 12
+        assert client.peak == service.file_processor.config.OCR_PAGE_CONCURRENCY
+    
+    def test_failed_page_leaves_others_intact(self):
+        """Test that one failing page is reported without affecting the rest"""
+        client = PageClient(failing=("p2",))
+        service = self.make_service(client)
+        
+        results = asyncio.run(service._ocr_pages(iter(make_pages(["ocr", "ocr", "text"])), "doc"))
+        
+        assert [result.get("error") for result in results] == [None, "Page processing failed", None]
+        assert results[0]["text"] == "image p1"
+        assert results[2]["text"] == "text p3"
+    
+    def test_budget_is_released_after_failure(self):
+        """Test that page reservations are returned when pages fail"""
+        memory_budget = MemoryBudget(10_000, 1)
+        service = self.make_service(PageClient(failing=("p1", "p3")), memory_budget)
+        
+        asyncio.run(service._ocr_pages(iter(make_pages(["ocr"] * 6)), "doc", page_bytes=1000))
+        
+        assert memory_budget.used == 0
+        assert memory_budget.peak == 4000
+    
+    def test_reserved_page_is_handed_between_pages(self):
+        """Test that a request admitted with one page's memory runs extra pages only if there is room"""
+        for total, expected_peak in ((1000, 1), (10_000, 4)):
+            memory_budget = MemoryBudget(total, 1)
+            client = PageClient(delays={f"p{number}": 0.005 for number in range(1, 7)})
+            service = self.make_service(client, memory_budget)
+            
+            async def main():
+                async with memory_budget.reserve(1000):
+                    return await service._ocr_pages(iter(make_pages(["ocr"] * 6)), "doc",
+                                                    page_bytes=1000, page_reserved=True)
+            
+            results = asyncio.run(main())
+            
+            assert [result.get("error") for result in results] == [None] * 6
+            assert client.peak == expected_peak
+            assert memory_budget.used == 0
+    
+    def test_budget_and_pages_are_released_on_cancellation(self):
+        """Test that cancelling a request releases its reservations and closes the page iterator"""
+        memory_budget = MemoryBudget(10_000, 1)
+        client = PageClient(delays={f"p{number}": 1.0 for number in range(1, 9)})
+        service = self.make_service(client, memory_budget)
+        closed = []
+        
+        def pages():
+            try:
+                yield from make_pages(["ocr"] * 8)
+            finally:
+                closed.append(True)
+        
+        async def main():
+            task = asyncio.create_task(service._ocr_pages(pages(), "doc", page_bytes=1000))
+            await asyncio.sleep(0.05)
+            assert client.active == 4
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # Let the cancelled page tasks run their callbacks
+            await asyncio.sleep(0)
+        
+        asyncio.run(main())
+        
+        assert memory_budget.used == 0
+        assert client.active == 0
+        assert closed == [True]
+
+class SplitClient:
+    """Stub client whose image output needs 0.75 tokens per pixel row"""
+    
+    model_name = "stub-model"
+    
+    def __init__(self):
+        self.calls = []
+    
+    async def process_image_ocr(self, image_data, filename, max_tokens=2000, timeout=60.0):
+        from PIL import Image
+        
+        with Image.open(io.BytesIO(image_data)) as img:
+            height = img.height
+        self.calls.append((height, max_tokens))
+        return {"text": f"rows {height}", "confidence": 0.9, "model_used": self.model_name,
+                "truncated": max_tokens < 0.75 * height}
+
+class TestSplitRetry:
+    """Test the split-and-retry path for truncated pages"""
+    
+    def test_halves_get_at_least_the_parent_budget(self):
+        """Test that a truncated page is recovered by its halves"""
+        from PIL import Image
+        
+        client = SplitClient()
+        service = OCRService(client, FileProcessor(Config()))
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 2000), 'white').save(buffer, format='JPEG')
+        context = {"client_id": "client", "priority": "interactive", "queue": 0.0}
+        
+        result = asyncio.run(service._ocr_image(buffer.getvalue(), (2000, 2000), 0.0, "page", context))
+        
+        # The full page gets 1000 tokens but needs 1500; each half needs about 780
+        assert client.calls[0] == (2000, 1000)
+        assert [max_tokens for _, max_tokens in client.calls[1:]] == [1000, 1000]
+        assert len(client.calls) == 3
+        assert not result["truncated"]
+    
+    def test_overlapping_parts_are_deduplicated(self):
+        """Test that lines read by both halves appear once"""
+        merged = OCRService._merge_parts([
+            {"text": "first\nsecond\nthird  line\n", "confidence": 0.9, "truncated": False},
+            {"text": "third line\nfourth", "confidence": 0.8, "truncated": False},
+        ], overlapping=True)
+        
+        assert merged["text"] == "first\nsecond\nthird  line\nfourth"
+        assert merged["confidence"] == 0.8
+        assert not merged["truncated"]
+    
+    def test_text_parts_are_not_deduplicated(self):
+        """Test that text split at a line break keeps repeated lines"""
+        merged = OCRService._merge_parts([
+            {"text": "Total\n-----", "confidence": 0.95, "model_used": "stub-model"},
+            {"text": "-----\nSigned", "confidence": 0.95, "model_used": "fallback", "truncated": True},
+        ])
+        
+        assert merged["text"] == "Total\n-----\n-----\nSigned"
+        assert merged["model_used"] == "fallback"
+        assert merged["truncated"]
+
+class TestMemoryAdmission:
+    """Test that admitted requests can always make progress under the memory budget"""
+    
+    def test_burst_of_large_uploads_completes(self):
+        """Test that uploads filling the budget do not block each other's pages"""
+        from PIL import Image
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100), 'white').save(buffer, format='PNG')
+        # Data after the PNG end marker is ignored by decoders but counts as upload
+        content = buffer.getvalue() + bytes(200_000)
+        page_bytes = FileProcessor._estimate_frame_bytes((100, 100), 3)
+        memory_budget = MemoryBudget(len(content) + page_bytes, wait_seconds=2)
+        service = OCRService(StubClient(), FileProcessor(Config()), memory_budget=memory_budget)
+        
+        async def main():
+            return await asyncio.gather(*(
+                service.process_file(upload(content, f"scan{index}.png"))
+                for index in range(4)
+            ))
+        
+        results = asyncio.run(main())
+        
+        assert all(result["pages"][0].get("error") is None for result in results)
+        assert memory_budget.peak == len(content) + page_bytes
+        assert memory_budget.rejected == 0
+        assert memory_budget.used == 0
+    
+    def make_upload(self):
+        from PIL import Image
+        
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100), 'white').save(buffer, format='PNG')
+        content = buffer.getvalue() + bytes(200_000)
+        return content, FileProcessor._estimate_frame_bytes((100, 100), 3)
+    
+    def test_upload_is_read_after_reservation(self):
+        """Test that an upload waiting for memory has not been read yet"""
+        content, page_bytes = self.make_upload()
+        memory_budget = MemoryBudget(len(content) + page_bytes, wait_seconds=2)
+        service = OCRService(StubClient(), FileProcessor(Config()), memory_budget=memory_budget)
+        file = upload(content, "scan.png")
+        
+        async def main():
+            held = await memory_budget.acquire(memory_budget.total_bytes)
+            task = asyncio.create_task(service.process_file(file))
+            await asyncio.sleep(0.05)
+            position = file.file.tell()
+            memory_budget.release(held)
+            return position, await task
+        
+        position, result = asyncio.run(main())
+        
+        assert position == 0
+        assert result["pages"][0].get("error") is None
+        assert memory_budget.used == 0
+    
+    def test_waiting_for_first_page_holds_no_upload(self):
+        """Test that an upload whose first page does not fit gives its reservation back while waiting"""
+        content, page_bytes = self.make_upload()
+        memory_budget = MemoryBudget(len(content) + page_bytes, wait_seconds=2)
+        service = OCRService(StubClient(), FileProcessor(Config()), memory_budget=memory_budget)
+        
+        async def main():
+            held = await memory_budget.acquire(page_bytes)
+            task = asyncio.create_task(service.process_file(upload(content, "scan.png")))
+            await asyncio.sleep(0.05)
+            waiting = memory_budget.stats()
+            memory_budget.release(held)
+            return waiting, await task
+        
+        waiting, result = asyncio.run(main())
+        
+        assert waiting["used_bytes"] == page_bytes
+        assert waiting["waiting"] == 1
+        assert result["pages"][0].get("error") is None
+        assert memory_budget.peak == len(content) + page_bytes
+        assert memory_budget.used == 0
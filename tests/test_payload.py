@@ -0,0 +1,44 @@
+"""Unit tests for vision request body construction"""
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.payload import VisionPayloadBuilder, CHUNK_SIZE
+
+class TestVisionPayloadBuilder:
+    """Test the VisionPayloadBuilder class"""
+    
+    def test_body_matches_chat_completion_payload(self):
+        """Test that the streamed body is the expected JSON document"""
+        builder = VisionPayloadBuilder("model", 'Read "this" image')
+        image_data = os.urandom(CHUNK_SIZE * 2 + 5)
+        
+        length, chunks = builder.build(image_data, max_tokens=512)
+        body = b"".join(chunks)
+        payload = json.loads(body)
+        
+        assert len(body) == length
+        assert payload["model"] == "model"
+        assert payload["max_tokens"] == 512
+        content = payload["messages"][0]["content"]
+        assert content[0]["text"] == 'Read "this" image'
+        assert content[1]["image_url"]["url"] == (
+            "data:image/jpeg;base64," + base64.b64encode(image_data).decode("ascii")
+        )
+    
+    def test_framing_is_cached(self):
+        """Test that the JSON around the image is rendered once per MIME type"""
+        builder = VisionPayloadBuilder("model", "prompt")
+        
+        builder.build(b"abc", max_tokens=100)
+        _, chunks = builder.build(b"defg", max_tokens=3172)
+        _, png_chunks = builder.build(b"abc", max_tokens=100, mime_type="image/png")
+        
+        assert len(builder._frames) == 2
+        assert json.loads(b"".join(chunks))["max_tokens"] == 3172
+        assert b"data:image/png;base64," in next(png_chunks)
@@ -0,0 +1,99 @@
+"""Unit tests for the OCR scheduler"""
+import asyncio
+import sys
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.scheduler import OCRScheduler, INTERACTIVE, BATCH
+
+WEIGHTS = {INTERACTIVE: 4.0, BATCH: 1.0}
+
+def run_jobs(scheduler, jobs):
+    """Submit (client, priority) jobs in order and return the order they ran in"""
+    order = []
+    
+    async def job(name):
+        order.append(name)
+        await asyncio.sleep(0.001)
+    
+    async def main():
+        await asyncio.gather(*(
+            scheduler.run(client, priority, lambda name=name: job(name))
+            for name, client, priority in jobs
+        ))
+    
+    asyncio.run(main())
+    return order
+
+class TestOCRScheduler:
+    """Test the OCRScheduler class"""
+    
+    def test_concurrency_is_bounded(self):
+        """Test that no more than the configured number of calls run at once"""
+        scheduler = OCRScheduler(2, WEIGHTS)
+        active = 0
+        peak = 0
+        
+        async def call():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.005)
+            active -= 1
+        
+        async def main():
+            await asyncio.gather(*(scheduler.run("client", BATCH, call) for _ in range(8)))
+        
+        asyncio.run(main())
+        assert peak == 2
+        assert scheduler.stats()["active"] == 0
+    
+    def test_interactive_job_overtakes_batch_backlog(self):
+        """Test that a small interactive job does not wait behind a bulk upload"""
+        scheduler = OCRScheduler(1, WEIGHTS)
+        jobs = [(f"bulk-{page}", "bulk", BATCH) for page in range(10)]
+        jobs.append(("receipt", "user", INTERACTIVE))
+        
+        order = run_jobs(scheduler, jobs)
+        
+        assert order.index("receipt") <= 2
+    
+    def test_clients_in_same_class_interleave(self):
+        """Test that two bulk clients share the model fairly"""
+        scheduler = OCRScheduler(1, WEIGHTS)
+        jobs = [(f"a-{page}", "a", BATCH) for page in range(5)]
+        jobs += [(f"b-{page}", "b", BATCH) for page in range(5)]
+        
+        order = run_jobs(scheduler, jobs)
+        
+        # After the first job, the two clients alternate
+        clients = [name[0] for name in order[1:]]
+        assert all(first != second for first, second in zip(clients, clients[1:]))
+    
+    def test_class_share_does_not_grow_with_clients(self):
+        """Test that many batch clients together get only the batch class's share"""
+        scheduler = OCRScheduler(1, WEIGHTS)
+        jobs = []
+        for page in range(10):
+            jobs += [(f"batch{client}-{page}", f"bulk{client}", BATCH) for client in range(12)]
+        jobs += [(f"receipt-{page}", "user", INTERACTIVE) for page in range(40)]
+        
+        order = run_jobs(scheduler, jobs)
+        
+        # 4:1 weights: interactive gets 80% of the first 40 dispatches
+        assert sum(name.startswith("receipt") for name in order[:40]) >= 31
+        # Batch clients still share the batch slots equally
+        batch_clients = [name.split("-")[0] for name in order[:80] if name.startswith("batch")]
+        assert len(set(batch_clients)) == 12
+    
+    def test_stats(self):
+        """Test that per-class counters are reported"""
+        scheduler = OCRScheduler(1, WEIGHTS)
+        run_jobs(scheduler, [("one", "a", BATCH), ("two", "b", INTERACTIVE)])
+        
+        stats = scheduler.stats()
+        assert stats["classes"][BATCH]["dispatched"] == 1
+        assert stats["classes"][INTERACTIVE]["dispatched"] == 1
+        assert stats["classes"][BATCH]["queue_depth"] == 0
@@ -0,0 +1,83 @@
+"""Unit tests for cross-worker shared state"""
+import asyncio
+import sys
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.shared_state import SharedCache, SharedLimiter
+
+class TestSharedCache:
+    """Test the SharedCache class"""
+    
+    def test_round_trip(self, tmp_path):
+        """Test that stored results are visible to a second connection"""
+        writer = SharedCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+        reader = SharedCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+        writer.open()
+        reader.open()
+        
+        writer.set("key", {"text": "hello", "confidence": 0.9})
+        
+        assert reader.get("key") == {"text": "hello", "confidence": 0.9}
+        assert reader.get("missing") is None
+        
+        writer.close()
+        reader.close()
+    
+    def test_disabled_cache(self, tmp_path):
+        """Test that a zero TTL disables the cache"""
+        cache = SharedCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=0)
+        cache.open()
+        cache.set("key", {"text": "hello"})
+        
+        assert cache.enabled == False
+        assert cache.get("key") is None
+        assert not (tmp_path / "cache.sqlite3").exists()
+
+class TestSharedLimiter:
+    """Test the SharedLimiter class"""
+    
+    def test_slots_are_exclusive(self, tmp_path):
+        """Test that no more than the configured number of slots are handed out"""
+        limiter = SharedLimiter(str(tmp_path), "test", slots=2)
+        
+        first = limiter.try_acquire()
+        second = limiter.try_acquire()
+        
+        assert first is not None
+        assert second is not None
+        assert limiter.try_acquire() is None
+        
+        limiter.release(first)
+        third = limiter.try_acquire()
+        assert third is not None
+        
+        limiter.release(second)
+        limiter.release(third)
+    
+    def test_slot_context_limits_concurrency(self, tmp_path):
+        """Test that the async context manager bounds concurrent holders"""
+        limiter = SharedLimiter(str(tmp_path), "test", slots=2, poll_interval=0.001)
+        active = 0
+        peak = 0
+        
+        async def worker():
+            nonlocal active, peak
+            async with limiter.slot():
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+        
+        async def run():
+            await asyncio.gather(*(worker() for _ in range(6)))
+        
+        asyncio.run(run())
+        assert peak == 2
+        
+        stats = limiter.stats()
+        assert stats["acquired"] == 6
+        assert stats["waited"] == 4
+        assert stats["max_wait_seconds"] > 0